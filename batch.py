@@ -0,0 +1,241 @@
+import numpy as np
+
+
+NOOP, UP, DOWN, LEFT, RIGHT = range(5)
+
+# Indexed by action: the moveDir SnakeController.on_keydown would pick
+_ACTION_DX = np.array([0, 0, 0, -1, 1], dtype=np.int64)
+_ACTION_DY = np.array([0, -1, 1, 0, 0], dtype=np.int64)
+
+
+class SnakeBatch:
+    """
+    N independent snake games advanced in lockstep.
+
+    The rules mirror SnakeController/Tail/TailCollider from main.py step for
+    step (including float operation order), but the whole state lives in
+    NumPy arrays. The trail is a per-game ring buffer of corner points,
+    trimmed to the part that is still covered by the snake's length.
+    """
+
+    def __init__(self, n, size=(800, 600), dt=16, speed=0.15, startLength=22, width=32,
+                 headSize=32, foodSize=16, capacity=256, trimSlack=2, seed=None):
+        self.n = n
+        self.size = size
+        self.dt = dt
+        self.speed = speed
+        self.startLength = startLength
+        self.width = width
+        self.headSize = headSize
+        self.foodSize = foodSize
+        self.capacity = capacity
+        self.trimSlack = trimSlack
+        self.rng = np.random.default_rng(seed)
+
+        self.headX = np.zeros(n)
+        self.headY = np.zeros(n)
+        self.dirX = np.zeros(n, dtype=np.int64)
+        self.dirY = np.zeros(n, dtype=np.int64)
+        self.length = np.zeros(n, dtype=np.int64)
+        self.foodX = np.zeros(n)
+        self.foodY = np.zeros(n)
+        self.trailX = np.zeros((n, capacity))
+        self.trailY = np.zeros((n, capacity))
+        self.trailGap = np.zeros((n, capacity), dtype=bool)
+        self.trailStart = np.zeros(n, dtype=np.int64)
+        self.trailCount = np.zeros(n, dtype=np.int64)
+        # TailCollider looks at the gap flags of the first two recorded points,
+        # which survive here even after the trail has been trimmed past them
+        self.firstGaps = np.zeros((n, 2), dtype=bool)
+        self.trimmed = np.zeros(n, dtype=bool)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.scores = np.zeros(n, dtype=np.int64)
+        # Score, length and steps of each game's last finished episode, taken
+        # before step() resets it; read them at the rows step() reports dead
+        self.finalScores = np.zeros(n, dtype=np.int64)
+        self.finalLengths = np.zeros(n, dtype=np.int64)
+        self.finalSteps = np.zeros(n, dtype=np.int64)
+
+        self._rows = np.arange(n)
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        idx = np.flatnonzero(mask)
+        self.headX[idx] = 0
+        self.headY[idx] = 0
+        self.dirX[idx] = 1
+        self.dirY[idx] = 0
+        self.length[idx] = self.startLength
+        self.trailStart[idx] = 0
+        self.trailCount[idx] = 0
+        self.trailGap[idx] = False
+        self.firstGaps[idx] = False
+        self.trimmed[idx] = False
+        self.steps[idx] = 0
+        self.scores[idx] = 0
+        self._eat(idx)
+
+    def _eat(self, idx):
+        self.length[idx] += 1
+        width, height = self.size
+        half = self.foodSize / 2
+        rx = self.rng.random(len(idx))
+        ry = self.rng.random(len(idx))
+        self.foodX[idx] = half + rx * (width - self.foodSize)
+        self.foodY[idx] = half + ry * (height - self.foodSize)
+
+    def _steer(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        newX = _ACTION_DX[actions]
+        newY = _ACTION_DY[actions]
+        # Same test as on_keydown: only turns perpendicular to moveDir are taken
+        turn = (actions != NOOP) & (newX * self.dirY + newY * self.dirX != 0)
+        self.dirX[turn] = newX[turn]
+        self.dirY[turn] = newY[turn]
+
+    def _move(self):
+        width, height = self.size
+        self.headX = np.mod(self.headX + (self.dirX * self.speed) * self.dt, width)
+        self.headY = np.mod(self.headY + (self.dirY * self.speed) * self.dt, height)
+
+    def _addTrail(self):
+        C = self.capacity
+        rows = self._rows
+        count = self.trailCount
+        start = self.trailStart
+        lastIdx = (start + count - 1) % C
+        prevIdx = (start + count - 2) % C
+        lastX = self.trailX[rows, lastIdx]
+        lastY = self.trailY[rows, lastIdx]
+        curDirX = self.headX - lastX
+        curDirY = self.headY - lastY
+        lastDirX = lastX - self.trailX[rows, prevIdx]
+        lastDirY = lastY - self.trailY[rows, prevIdx]
+
+        full = count >= 2
+        gap = full & (curDirX * self.dirX + curDirY * self.dirY < 0)
+        merge = full & ~gap & (curDirX * lastDirX + curDirY * lastDirY > 0)
+        count = count - merge
+
+        pos = (start + count) % C
+        self.trailX[rows, pos] = self.headX
+        self.trailY[rows, pos] = self.headY
+        self.trailGap[rows, pos] = gap
+        count = count + 1
+
+        first = ~self.trimmed & (count <= 2)
+        self.firstGaps[rows[first], count[first] - 1] = gap[first]
+
+        overflow = count > C
+        self.trailStart = np.where(overflow, (start + 1) % C, start)
+        self.trimmed |= overflow
+        self.trailCount = np.minimum(count, C)
+
+    def _orderedTrail(self):
+        # Newest point first, only as many columns as the longest trail needs
+        K = max(int(self.trailCount.max()), 1)
+        ks = np.arange(K)
+        idx = (self.trailStart[:, None] + self.trailCount[:, None] - 1 - ks) % self.capacity
+        rows = self._rows[:, None]
+        valid = ks < self.trailCount[:, None]
+        return self.trailX[rows, idx], self.trailY[rows, idx], self.trailGap[rows, idx], valid
+
+    @staticmethod
+    def _rects(x0, y0, x1, y1):
+        rx1, ry1 = np.round(x0), np.round(y0)
+        rx2, ry2 = np.round(x1), np.round(y1)
+        return (np.minimum(rx1, rx2), np.minimum(ry1, ry2),
+                np.abs(np.round(x1 - x0)), np.abs(np.round(y1 - y0)))
+
+    @staticmethod
+    def _overlap(ax, ay, aw, ah, bx, by, bw, bh):
+        return ((aw > 0) & (ah > 0) & (bw > 0) & (bh > 0) &
+                (ax < bx + bw) & (bx < ax + aw) & (ay < by + bh) & (by < ay + ah))
+
+    def _headRect(self):
+        half = self.headSize / 2
+        return np.round(self.headX + -half), np.round(self.headY + -half), self.headSize, self.headSize
+
+    def _collideFood(self):
+        half = self.foodSize / 2
+        fx = np.round(self.foodX + -half)
+        fy = np.round(self.foodY + -half)
+        return self._overlap(*self._headRect(), fx, fy, self.foodSize, self.foodSize)
+
+    def _collideTail(self):
+        if self.trailCount.max() < 2:
+            return np.zeros(self.n, dtype=bool)
+        px, py, pgap, valid = self._orderedTrail()
+        prevX, prevY, prevGap = px[:, :-1], py[:, :-1], pgap[:, :-1]
+        curX, curY = px[:, 1:], py[:, 1:]
+        seg = valid[:, 1:] & ~prevGap
+
+        dx = curX - prevX
+        dy = curY - prevY
+        segLen = np.where(seg, np.hypot(dx, dy), 0)
+        limit = (self.length * 32).astype(float)
+        # Sequential subtraction, exactly like getTrail's running `rem`
+        rem = np.subtract.accumulate(np.concatenate([limit[:, None], segLen], axis=1), axis=1)
+        remBefore, rem = rem[:, :-1], rem[:, 1:]
+        visible = seg & (remBefore > 0)
+        cut = visible & (rem <= 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv = 1 / np.where(seg, segLen, 1)
+        dirX = dx * inv
+        dirY = dy * inv
+        half = self.width / 2
+        radX = -dirY * half
+        radY = dirX * half
+        x0 = (prevX - radX) - dirX * 16
+        y0 = (prevY - radY) - dirY * 16
+        endX = np.where(cut, curX + dirX * rem, curX)
+        endY = np.where(cut, curY + dirY * rem, curY)
+        x1 = (endX + radX) + dirX * 16
+        y1 = (endY + radY) + dirY * 16
+        rx, ry, rw, rh = self._rects(x0, y0, x1, y1)
+
+        count = self.trailCount + self.trimmed
+        skip = (~self.firstGaps[:, 0]).astype(np.int64) + ((count >= 2) & ~self.firstGaps[:, 1])
+        rank = np.cumsum(visible, axis=1) - 1
+        test = visible & (rank >= skip[:, None])
+        hx, hy, hw, hh = self._headRect()
+        hit = test & self._overlap(hx[:, None], hy[:, None], hw, hh, rx, ry, rw, rh)
+
+        self._trim(seg, remBefore)
+        return hit.any(axis=1)
+
+    def _trim(self, seg, remBefore):
+        # Keep `trimSlack` extra units of history so eating still uncovers
+        # old trail behind the tail, exactly like the unbounded original
+        kept = seg & (remBefore + self.trimSlack * 32 > 0)
+        hasKept = kept.any(axis=1)
+        lastSeg = kept.shape[1] - 1 - np.argmax(kept[:, ::-1], axis=1)
+        keep = np.where(hasKept, lastSeg + 2, self.trailCount)
+        cutMask = keep < self.trailCount
+        if cutMask.any():
+            self.trimmed |= cutMask
+            dropped = self.trailCount - keep
+            self.trailStart = np.where(cutMask, (self.trailStart + dropped) % self.capacity, self.trailStart)
+            self.trailCount = np.where(cutMask, keep, self.trailCount)
+
+    def step(self, actions=None):
+        if actions is not None:
+            self._steer(actions)
+        self._move()
+        self._addTrail()
+        ate = self._collideFood()
+        if ate.any():
+            idx = np.flatnonzero(ate)
+            self.scores[idx] += 1
+            self._eat(idx)
+        dead = self._collideTail()
+        self.steps += 1
+        if dead.any():
+            self.finalScores[dead] = self.scores[dead]
+            self.finalLengths[dead] = self.length[dead]
+            self.finalSteps[dead] = self.steps[dead]
+            self.reset(dead)
+        return ate, dead
@@ -0,0 +1,488 @@
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def perOp(stmt, number, repeat=5):
+    # Best of `repeat` runs, in nanoseconds per call
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1e9
+
+
+def loadEngine(rev=None):
+    if rev is None:
+        import engine
+        return engine
+    source = subprocess.check_output(["git", "show", "{}:engine.py".format(rev)],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(tempfile.mkdtemp(), "engine.py")
+    with open(path, "wb") as file:
+        file.write(source)
+    spec = importlib.util.spec_from_file_location("engine_{}".format(rev), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@benchmark("vector")
+def benchVector(engine, number=200000):
+    Vector2 = engine.Vector2
+    a = Vector2(1.5, -2.5)
+    b = Vector2(0.25, 4.0)
+    res = {
+        "new(x, y)": perOp(lambda: Vector2(1.5, -2.5), number),
+        "new(tuple)": perOp(lambda: Vector2((1.5, -2.5)), number),
+        "copy": perOp(lambda: a.copy(), number),
+        "add": perOp(lambda: a + b, number),
+        "sub": perOp(lambda: a - b, number),
+        "mul": perOp(lambda: a * 3.0, number),
+        "dot": perOp(lambda: a * b, number),
+        "neg": perOp(lambda: -a, number),
+        "normalize": perOp(lambda: a.normalize(), number),
+        "rotate90": perOp(lambda: a.rotate90(), number),
+        "round": perOp(lambda: round(a), number),
+        "rect": perOp(lambda: Vector2.rect(a, b), number),
+    }
+    if hasattr(Vector2, "iadd_"):
+        c = Vector2(0, 0)
+        res["iadd_"] = perOp(lambda: c.iadd_(b), number)
+        res["imul_"] = perOp(lambda: c.imul_(1.0), number)
+    return res
+
+
+@benchmark("polyline")
+def benchPolyline(engine, points=500, number=20):
+    # A getTrail-style polyline -> rects conversion, per segment vs batched
+    Vector2 = engine.Vector2
+    poly = [Vector2(float(i * 7 % 800), float(i * 13 % 600)) for i in range(points)]
+    
+    def scalar():
+        res = []
+        for prevPoint, curPoint in zip(poly, poly[1:]):
+            dir = (curPoint - prevPoint).normalize()
+            radius = dir.rotate90() * 16
+            res.append(Vector2.rect(prevPoint - radius - dir * 16, curPoint + radius + dir * 16))
+        return res
+    
+    res = {"Vector2 loop": perOp(scalar, number) / (points - 1)}
+    if hasattr(engine, "Vector2Array"):
+        arr = engine.Vector2Array(poly)
+        
+        def batched():
+            prev, cur = arr[:-1], arr[1:]
+            dir = (cur - prev).normalize()
+            radius = dir.rotate90() * 16
+            return engine.Vector2Array.rect(prev - radius - dir * 16, cur + radius + dir * 16)
+        
+        res["Vector2Array"] = perOp(batched, number) / (points - 1)
+    return res
+
+
+def buildTree(engine, width, depth):
+    # `width` chains of `depth` objects each under one root, every object with one on_tick handler
+    class Ticker(engine.Behaviour):
+        def on_tick(self, scene):
+            pass
+    
+    root = engine.GameObject("root")
+    root.addComponent(engine.Transform)
+    for _ in range(width):
+        parent = root
+        for _ in range(depth):
+            obj = engine.GameObject()
+            obj.addComponent(Ticker)
+            obj.instantiate(parent)
+            parent = obj
+    return root
+
+
+@benchmark("broadcast")
+def benchBroadcast(engine, number=20):
+    res = {}
+    for width, depth in ((2000, 1), (20, 100), (1, 500)):
+        root = buildTree(engine, width, depth)
+        tr = root.transform
+        tr.broadcastMessage("tick", None)
+        name = "{}x{}".format(width, depth)
+        res[name] = perOp(lambda: tr.broadcastMessage("tick", None), number) / (width * depth)
+        res[name + " miss"] = perOp(lambda: tr.broadcastMessage("keyup", 0, 0), number) / (width * depth)
+    return res
+
+
+@benchmark("events")
+def benchEvents(engine, number=2000):
+    # One KEYDOWN listener in scenes of growing size
+    class Listener(engine.Behaviour):
+        def on_keydown(self, key, mod, unicode, scancode):
+            pass
+    
+    event = engine.pygame.event.Event(engine.pygame.KEYDOWN, key=engine.pygame.K_UP, mod=0, unicode="", scancode=0)
+    # Engines from before the headless mode (Scene.step came with it) need a window
+    headless = hasattr(engine.Scene, "step")
+    res = {}
+    for width, depth in ((10, 1), (1000, 1), (20, 100)):
+        scene = engine.Scene(headless=True) if headless else engine.Scene()
+        buildTree(engine, width, depth).instantiate(scene)
+        listener = engine.GameObject()
+        listener.addComponent(Listener)
+        listener.instantiate(scene)
+        scene.handleEvent(event)
+        res["keydown {}x{}".format(width, depth)] = perOp(lambda: scene.handleEvent(event), number)
+    return res
+
+
+@benchmark("transform")
+def benchTransform(engine, number=2000):
+    res = {}
+    for depth in (1, 10, 100):
+        root = engine.GameObject("root")
+        root.addComponent(engine.Transform)
+        obj = root
+        for _ in range(depth):
+            child = engine.GameObject()
+            child.instantiate(obj, pos=(1.0, 2.0))
+            obj = child
+        tr = obj.transform
+        res["depth {}".format(depth)] = perOp(tr.getAbsolutePosition, number)
+        top = root.transform
+        
+        def moveRoot():
+            top.pos = top.pos
+            return tr.getAbsolutePosition()
+        
+        res["depth {} moved".format(depth)] = perOp(moveRoot, number)
+    return res
+
+
+@benchmark("components")
+def benchComponents(engine, number=100000):
+    obj = engine.GameObject()
+    obj.addComponent(engine.Transform)
+    for _ in range(4):
+        obj.addComponent(engine.Behaviour)
+    obj.addComponent(engine.BoxTexture, (8, 8), (255, 255, 255))
+    obj.addComponent(engine.BoxCollider, (8, 8))
+    return {
+        "transform": perOp(lambda: obj.transform, number),
+        "getComponent": perOp(lambda: obj.getComponent(engine.Collider), number),
+        "getComponents": perOp(lambda: obj.getComponents(engine.Behaviour), number),
+    }
+
+
+@benchmark("collision")
+def benchCollision(engine, number=20):
+    if not hasattr(engine, "CollisionWorld"):
+        return {}
+    import random
+    rng = random.Random(0)
+    res = {}
+    for count in (100, 400, 1600):
+        scene = engine.Scene(size=(1600, 1600), headless=True, collisions=True)
+        for i in range(count):
+            obj = engine.GameObject()
+            obj.addComponent(engine.BoxCollider, (16, 16), layer=1 << (i % 2), mask=1)
+            obj.instantiate(scene, pos=(rng.uniform(0, 1600), rng.uniform(0, 1600)))
+        world = scene.collisionWorld
+        world.update()
+        # Per collider and update, so linear scaling shows up as a flat line
+        res["{} colliders".format(count)] = perOp(world.update, number) / count
+    return res
+
+
+def buildSnake(engine, length, speed=2.4, rowWidth=3200, rowGap=48):
+    # A Tail under a bare SnakeController, fed a boustrophedon path long enough
+    # for `length` units (32px each); returns the tail and a function to advance it
+    import main
+    owner = engine.GameObject("snake")
+    owner.addComponent(engine.Transform)
+    owner.addComponent(main.SnakeController)
+    owner.getComponent(main.SnakeController).length = length
+    tail = main.Tail("tail")
+    tail.instantiate(owner)
+    state = {"pos": engine.Vector2(0.0, 0.0), "dir": engine.Vector2(1, 0), "run": 0.0, "row": 1}
+    
+    def advance():
+        pos, dir = state["pos"], state["dir"]
+        if dir.y == 0 and state["run"] >= rowWidth:
+            dir = engine.Vector2(0, 1)
+            state["run"] = 0.0
+        elif dir.y != 0 and state["run"] >= rowGap:
+            state["row"] += 1
+            dir = engine.Vector2(1 if state["row"] % 2 else -1, 0)
+            state["run"] = 0.0
+        pos = pos + dir * speed
+        state["pos"], state["dir"] = pos, dir
+        state["run"] += speed
+        tail.addTrail(pos, dir)
+    
+    for _ in range(int(length * 32 / speed) + 1):
+        advance()
+    return tail, advance
+
+
+@benchmark("tail")
+def benchTail(engine, number=50):
+    import engine as current
+    if engine is not current:
+        return {}
+    res = {}
+    for length in (10, 100, 1000, 10000):
+        tail, advance = buildSnake(engine, length)
+        width = tail.width
+        
+        def tick():
+            advance()
+            tail.getTrail(width)
+            tail.getTrail(width)
+        
+        import main
+        head = engine.GameObject("head")
+        box = engine.BoxCollider(head, (32, 32), offset=(-16, -16))
+        head.addComponent(engine.Transform, parent=tail.getParent().transform)
+        collider = tail.getComponent(main.TailCollider)
+        
+        def collide():
+            advance()
+            head.transform.pos = tail.trail[-1][0]
+            return collider._collide(box)
+        
+        res["tick len {}".format(length)] = perOp(tick, number)
+        res["collide len {}".format(length)] = perOp(collide, number)
+    return res
+
+
+@benchmark("snapshot")
+def benchSnapshot(engine, number=2000):
+    import engine as current
+    if engine is not current:
+        return {}
+    import main
+    res = {}
+    for length in (23, 200, 1000):
+        scene = engine.Scene(headless=True, fixedDt=16, seed=0)
+        controller = main.spawnSnake(scene).getComponent(main.SnakeController)
+        scene.start()
+        tail, advance = buildSnake(engine, length)
+        # Graft the long zigzag trail onto the real game so restore rebuilds all of it
+        controller.length = length
+        controller.tail.restore(tail.snapshot())
+        data = controller.snapshot()
+        res["snapshot len {}".format(length)] = perOp(controller.snapshot, number)
+        res["restore len {}".format(length)] = perOp(lambda: controller.restore(data), number)
+    return res
+
+
+@benchmark("game")
+def benchGame(engine, number=2000):
+    # Whole headless ticks of the real game, the snake circling a 240px square
+    import engine as current
+    if engine is not current:
+        return {}
+    import main
+    keys = (engine.pygame.K_DOWN, engine.pygame.K_LEFT, engine.pygame.K_UP, engine.pygame.K_RIGHT)
+    scene = engine.Scene(headless=True, fixedDt=16, seed=0)
+    controller = main.spawnSnake(scene).getComponent(main.SnakeController)
+    scene.start()
+    
+    def tick():
+        if scene.tickCount % 100 == 99:
+            key = keys[scene.tickCount // 100 % 4]
+            scene.handleEvent(engine.pygame.event.Event(engine.pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0))
+        scene.tick(scene.fixedDt)
+    
+    for _ in range(1000):
+        tick()
+    assert scene.running
+    return {"tick": perOp(tick, number)}
+
+
+@benchmark("grid")
+def benchGrid(engine, number=20000):
+    # The discrete engine circling a 6x6 square, next to the continuous game's tick
+    import engine as current
+    if engine is not current:
+        return {}
+    import grid
+    keys = (engine.pygame.K_DOWN, engine.pygame.K_LEFT, engine.pygame.K_UP, engine.pygame.K_RIGHT)
+    scene = engine.Scene(headless=True, fixedDt=16, seed=0)
+    snake = engine.GameObject("snake")
+    snake.addComponent(grid.GridSnakeController, stepTime=16)
+    snake.instantiate(scene)
+    scene.start()
+    controller = snake.getComponent(grid.GridSnakeController)
+    
+    def turn():
+        if controller.steps % 6 == 5:
+            controller.on_keydown(keys[controller.steps // 6 % 4], 0, "", 0)
+    
+    def tick():
+        turn()
+        scene.tick(scene.fixedDt)
+    
+    def step():
+        turn()
+        return controller.step()
+    
+    for _ in range(1000):
+        tick()
+    assert scene.running
+    return {
+        "grid tick": perOp(tick, number),
+        "grid step": perOp(step, number),
+        "continuous tick": benchGame(engine)["tick"],
+    }
+
+
+@benchmark("food")
+def benchFood(engine, number=20000):
+    # Drawing a free cell on a 100x100 board as it fills up, vs retrying random cells
+    if not hasattr(engine, "FreeCellSet"):
+        return {}
+    import random
+    rng = random.Random(0)
+    size = 100 * 100
+    res = {}
+    for fill in (0.0, 0.9, 0.999):
+        free = engine.FreeCellSet(size)
+        occupied = bytearray(size)
+        for cell in rng.sample(range(size), int(size * fill)):
+            free.remove(cell)
+            occupied[cell] = 1
+        
+        def retry():
+            while True:
+                cell = rng.randrange(size)
+                if not occupied[cell]:
+                    return cell
+        
+        res["free set {:.1%}".format(fill)] = perOp(lambda: free.sample(rng), number)
+        res["retry {:.1%}".format(fill)] = perOp(retry, number // 10)
+    return res
+
+
+@benchmark("draw")
+def benchDraw(engine, number=20):
+    import random
+    rng = random.Random(0)
+    scene = engine.Scene(size=(800, 600))
+    colors = [(0, 255, 0), (255, 255, 255), (255, 0, 0)]
+    res = {}
+    for count in (100, 1000, 5000, 20000):
+        commands = [(colors[i % 3], engine.pygame.Rect(rng.randrange(800), rng.randrange(600), 32, 32), i % 3)
+                    for i in range(count)]
+        if hasattr(engine, "RenderQueue"):
+            queue = scene.drawBuf
+            
+            def frame():
+                queue.clear()
+                for color, rect, zIndex in commands:
+                    queue.add(color, rect, zIndex)
+                scene.drawAll()
+        else:
+            def frame():
+                scene.drawBuf = []
+                for command in commands:
+                    scene.drawBuf.append(command)
+                scene.drawAll()
+        
+        frame()
+        # A whole frame: submitting every command, then drawing them
+        res["frame {}".format(count)] = perOp(frame, number) / count
+    return res
+
+
+def report(name, results, baseline=None, tolerance=None):
+    # Returns the ops that got slower than `baseline` by more than `tolerance`
+    print("[{}]".format(name))
+    if baseline is not None:
+        print("  {:<18}{:>13}{:>13}  speedup".format("op", "current", "baseline"))
+    regressions = []
+    for op, ns in results.items():
+        line = "  {:<18}{:>10.1f} ns".format(op, ns)
+        if baseline is not None and op in baseline:
+            line += "{:>10.1f} ns  x{:.2f}".format(baseline[op], baseline[op] / ns)
+            if tolerance is not None and ns > baseline[op] * (1 + tolerance):
+                line += "  REGRESSION"
+                regressions.append(op)
+        print(line)
+    return regressions
+
+
+def metadata():
+    import platform
+    import pygame
+    return {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "sdl": ".".join(map(str, pygame.get_sdl_version())),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench-baseline.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine micro-benchmarks")
+    parser.add_argument("names", nargs="*", default=None, help="benchmarks to run (default: all)")
+    parser.add_argument("--against", metavar="REV", help="also time engine.py from this git revision")
+    parser.add_argument("--baseline", metavar="PATH", nargs="?", const=BASELINE,
+                        help="compare against stored results (default: {})".format(os.path.basename(BASELINE)))
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown vs the baseline that counts as a regression (default: 0.25)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON ('-' for stdout)")
+    args = parser.parse_args()
+    assert not (args.against and args.baseline), "--against and --baseline are exclusive"
+
+    engine = loadEngine()
+    other = loadEngine(args.against) if args.against else None
+    stored = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            stored = json.load(file)["results"]
+    results = {}
+    regressions = []
+    for name in args.names or BENCHMARKS:
+        func = BENCHMARKS[name]
+        if other is not None:
+            baseline = func(other)
+        elif stored is not None:
+            baseline = stored.get(name, {})
+        else:
+            baseline = None
+        results[name] = func(engine)
+        tolerance = args.tolerance if stored is not None else None
+        regressions += ["{}/{}".format(name, op) for op in report(name, results[name], baseline, tolerance)]
+    
+    if args.json:
+        data = {"meta": metadata(), "results": results}
+        if args.json == "-":
+            json.dump(data, sys.stdout, indent=2)
+        else:
+            with open(args.json, "w") as file:
+                json.dump(data, file, indent=2)
+    if regressions:
+        print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)), file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
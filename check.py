@@ -0,0 +1,179 @@
+import argparse
+import os
+import random
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import engine
+import main as game
+
+
+# Randomised cross-checks of the optimised paths against the plain code they replace.
+# Each returns (cases checked, list of mismatch descriptions).
+CHECKS = {}
+
+KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+
+
+def check(name):
+    def decorator(func):
+        CHECKS[name] = func
+        return func
+    return decorator
+
+
+def keydown(key):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0)
+
+
+@check("tail")
+def checkTail(seeds=5, ticks=4000):
+    # Tail.collideRect / sweepRect (grid lookups) against testing every rect of getTrail,
+    # and getTrail (incremental) against _buildTrail, along random non-dying paths
+    cases = 0
+    failures = []
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        scene = engine.Scene(headless=True, fixedDt=16, seed=seed)
+        controller = game.spawnSnake(scene).getComponent(game.SnakeController)
+        scene.start()
+        controller.length = 200
+        tail = controller.tail
+        bounds = scene.screen.get_rect()
+        for tick in range(ticks):
+            if rng.random() < 0.03:
+                scene.handleEvent(keydown(rng.choice(KEYS)))
+            # Moved by hand rather than stepped, so the snake survives crossing itself
+            head = controller.head.transform
+            head.pos = (head.pos + controller.moveDir * 2.4).clamp(bounds)
+            tail.addTrail(head.pos, controller.moveDir)
+            if rng.random() < 0.01:
+                controller.length += 1
+            if tick % 20:
+                continue
+            if tail.getTrail(tail.width) != tail._buildTrail(tail.width):
+                failures.append("seed {} tick {}: getTrail differs from _buildTrail".format(seed, tick))
+            skip = tail.getComponent(game.TailCollider)._neckSkip()
+            rects = tail.getTrail(tail.width)[skip:]
+            for _ in range(20):
+                rect = pygame.Rect(rng.randrange(-50, 850), rng.randrange(-50, 650), 32, 32)
+                delta = (rng.randrange(-70, 70), rng.randrange(-70, 70))
+                cases += 1
+                if tail.collideRect(rect, skip) != any(rect.colliderect(other) for other in rects):
+                    failures.append("seed {} tick {}: collideRect {}".format(seed, tick, rect))
+                hits = [engine.sweepRect(rect, delta, other) for other in rects]
+                first = min((hit for hit in hits if hit is not None), default=None)
+                if tail.sweepRect(rect, delta, skip) != first:
+                    failures.append("seed {} tick {}: sweepRect {} by {}".format(seed, tick, rect, delta))
+    return cases, failures
+
+
+@check("batch")
+def checkBatch(games=40, ticks=3000, grow=25):
+    # SnakeBatch against the object engine on the same scripted inputs: every game must
+    # die on the same tick. Food is parked off screen on both sides, as they place it
+    # with different RNGs, and the snakes grow on a schedule instead
+    import numpy as np
+    import batch
+    rng = np.random.default_rng(1)
+    actions = np.where(rng.random((ticks, games)) < 0.04, rng.integers(1, 5, (ticks, games)), batch.NOOP)
+    keys = {batch.UP: pygame.K_UP, batch.DOWN: pygame.K_DOWN, batch.LEFT: pygame.K_LEFT, batch.RIGHT: pygame.K_RIGHT}
+
+    snakes = batch.SnakeBatch(games, seed=0)
+
+    def parkFood(idx):
+        snakes.length[idx] += 1
+        snakes.foodX[idx] = snakes.foodY[idx] = -5000.0
+
+    snakes._eat = parkFood
+    snakes.foodX[:] = snakes.foodY[:] = -5000.0
+    batchDeaths = [None] * games
+    for tick in range(ticks):
+        if tick % grow == grow - 1:
+            snakes.length += 1
+        _, dead = snakes.step(actions[tick])
+        for idx in np.flatnonzero(dead):
+            if batchDeaths[idx] is None:
+                batchDeaths[idx] = tick
+
+    failures = []
+    for idx in range(games):
+        scene = engine.Scene(headless=True, fixedDt=16, seed=0)
+        controller = game.spawnSnake(scene).getComponent(game.SnakeController)
+
+        def eat(controller=controller):
+            controller.length += 1
+            controller.food.transform.pos = engine.Vector2(-5000.0, -5000.0)
+
+        controller.eat = eat
+        scene.start()
+        death = None
+        for tick in range(ticks):
+            if tick % grow == grow - 1:
+                controller.length += 1
+            if actions[tick, idx]:
+                scene.handleEvent(keydown(keys[actions[tick, idx]]))
+            scene.step()
+            if not scene.running:
+                death = tick
+                break
+        if death != batchDeaths[idx]:
+            failures.append("game {}: object engine died at tick {}, SnakeBatch at {}".format(idx, death, batchDeaths[idx]))
+    return games, failures
+
+
+@check("dirty")
+def checkDirty(seeds=3, frames=1500):
+    # Dirty-rect rendering against redrawing the whole queue: the screen must match
+    # a full render pixel for pixel after every frame
+    cases = 0
+    failures = []
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        scene = engine.Scene(headless=True, fixedDt=16, seed=seed, bgColor=(0, 0, 0), dirtyRects=True)
+        controller = game.spawnSnake(scene).getComponent(game.SnakeController)
+        scene.start()
+        textures = scene.transform._componentsInChildren
+        reference = pygame.Surface(scene.screen.get_size())
+        for frame in range(frames):
+            if rng.random() < 0.02:
+                scene.handleEvent(keydown(rng.choice(KEYS)))
+            if frame % 200 == 199:
+                controller.eat()
+            scene.step()
+            if not scene.running:
+                break
+            scene.drawBuf.clear()
+            for texture in textures(engine.Texture):
+                texture.beginFrame()
+            scene.transform.broadcastMessage("draw", scene.drawBuf, targetComponent=engine.Component)
+            scene._render()
+            reference.fill(scene.bgColor)
+            engine.Renderer().render(reference, scene.drawBuf)
+            cases += 1
+            if pygame.image.tobytes(reference, "RGB") != pygame.image.tobytes(scene.screen, "RGB"):
+                failures.append("seed {} frame {}: screen differs from a full redraw".format(seed, frame))
+    return cases, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-check optimised engine paths against brute force")
+    parser.add_argument("names", nargs="*", default=None, help="checks to run (default: all)")
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.names or CHECKS:
+        cases, failures = CHECKS[name]()
+        print("[{}] {} cases, {} mismatches".format(name, cases, len(failures)))
+        for failure in failures[:10]:
+            print("  " + failure)
+        failed += bool(failures)
+    if failed:
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,58 @@
 import pygame
 import math
-from collections import deque
+import contextlib
+from array import array
+import csv
+import json
+from collections import deque, namedtuple
 from enum import Enum
+import random
+import struct
 import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Only Vector2Array needs numpy
+    np = None
 
 
 class Vector2:
+    __slots__ = ("x", "y")
+    
     def __init__(self, *args):
-        if len(args) == 0:
-            self = Vector2(0, 0)
+        if len(args) == 2:
+            x, y = args
+            assert isinstance(x, (int, float)) and isinstance(y, (int, float))
         elif len(args) == 1:
-            if isinstance(args[0], (tuple, list)):
-                assert len(args[0]) == 2
-                assert isinstance(args[0][0], (int, float)) and isinstance(args[0][1], (int, float))
-                self.x = args[0][0]
-                self.y = args[0][1]
-            elif isinstance(args[0], Vector2):
-                self.x = args[0].x
-                self.y = args[0].y
+            # Tuples first: Vector2(pos) with a tuple is the common call
+            arg = args[0]
+            if isinstance(arg, (tuple, list)):
+                assert len(arg) == 2
+                x, y = arg
+                assert isinstance(x, (int, float)) and isinstance(y, (int, float))
+            elif isinstance(arg, Vector2):
+                x = arg.x
+                y = arg.y
             else:
                 assert False
-        elif len(args) == 2:
-            assert isinstance(args[0], (int, float)) and isinstance(args[1], (int, float))
-            self.x = args[0]
-            self.y = args[1]
+        elif len(args) == 0:
+            x = y = 0
         else:
             assert False
+        self.x = x
+        self.y = y
+    
+    @staticmethod
+    def _make(x, y):
+        # Unchecked constructor for internal use; skips the variadic dispatch above
+        return _newVector2(x, y)
     
     def tuple(self):
         return (self.x, self.y)
     
     def __round__(self, ndigits=0):
-        return Vector2(round(self.x, ndigits=ndigits), round(self.y, ndigits=ndigits))
+        return _newVector2(round(self.x, ndigits=ndigits), round(self.y, ndigits=ndigits))
     
     def __str__(self):
         return "({}, {})".format(self.x, self.y)
@@ -53,23 +74,24 @@ class Vector2:
     
     @staticmethod
     def fromPolar(r, phi):
-        return Vector2(r * math.cos(phi), r * math.sin(phi))
+        return _newVector2(r * math.cos(phi), r * math.sin(phi))
     
     def toPolar(self):
         return (abs(self), self.angle())
     
     def copy(self):
-        return Vector2(self)
+        return _newVector2(self.x, self.y)
     
     def normalize(self):
-        return self / abs(self)
+        inv = 1 / math.hypot(self.x, self.y)
+        return _newVector2(self.x * inv, self.y * inv)
     
     def lerp(self, other, time=0.5):
         return self * (1 - time) + other * time
     
     def _rotate(self, sin, cos, rel=None):
         if rel is None:
-            return Vector2(self.x * cos - self.y * sin, self.x * sin + self.y * cos)
+            return _newVector2(self.x * cos - self.y * sin, self.x * sin + self.y * cos)
         return (self - rel)._rotate(sin, cos) + rel
     
     def rotate(self, phi, rel=None):
@@ -80,33 +102,33 @@ class Vector2:
     
     def clamp(self, rect, loop=True):
         if loop:
-            return Vector2((self.x - rect.x) % rect.width + rect.x, (self.y - rect.y) % rect.height + rect.y)
-        return Vector2(max(rect.left, min(self.x, rect.right)), max(rect.top, min(self.y, rect.bottom)))
+            return _newVector2((self.x - rect.x) % rect.width + rect.x, (self.y - rect.y) % rect.height + rect.y)
+        return _newVector2(max(rect.left, min(self.x, rect.right)), max(rect.top, min(self.y, rect.bottom)))
     
     @staticmethod
     def rect(v1, v2):
-        x1, y1 = round(v1).tuple()
-        x2, y2 = round(v2).tuple()
-        size = tuple(map(abs, round(v2 - v1).tuple()))
+        x1, y1 = round(v1.x, ndigits=0), round(v1.y, ndigits=0)
+        x2, y2 = round(v2.x, ndigits=0), round(v2.y, ndigits=0)
+        size = (abs(round(v2.x - v1.x, ndigits=0)), abs(round(v2.y - v1.y, ndigits=0)))
         return pygame.Rect((min(x1, x2), min(y1, y2)), size)
     
     # ===[ Operators ]===
     
     def __add__(self, other):
         if isinstance(other, Vector2):
-            return Vector2(self.x + other.x, self.y + other.y)
+            return _newVector2(self.x + other.x, self.y + other.y)
         return NotImplemented
     
     def __sub__(self, other):
         if isinstance(other, Vector2):
-            return self + -other
+            return _newVector2(self.x - other.x, self.y - other.y)
         return NotImplemented
     
     def __mul__(self, other):
         if isinstance(other, Vector2):
             return self.x * other.x + self.y * other.y
         if isinstance(other, (int, float)):
-            return Vector2(self.x * other, self.y * other)
+            return _newVector2(self.x * other, self.y * other)
         return NotImplemented
     
     def __matmul__(self, other):
@@ -144,10 +166,40 @@ class Vector2:
         return self
     
     def __neg__(self):
-        return Vector2(-self.x, -self.y)
+        return _newVector2(-self.x, -self.y)
     
     def __pos__(self):
-        return Vector2(self.x, self.y)
+        return _newVector2(self.x, self.y)
+    
+    # ===[ In-place ]===
+    # Unlike the augmented operators above, these mutate the vector itself,
+    # so they must not be used on vectors that other objects still hold.
+    
+    def set_(self, x, y):
+        self.x = x
+        self.y = y
+        return self
+    
+    def iadd_(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+    
+    def isub_(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+    
+    def imul_(self, other):
+        self.x *= other
+        self.y *= other
+        return self
+    
+    def itruediv_(self, other):
+        inv = 1 / other
+        self.x *= inv
+        self.y *= inv
+        return self
     
     # ===[ Comparisons ]===
     
@@ -172,6 +224,189 @@ class Vector2:
         return other > self
 
 
+def _newVector2(x, y, _new=object.__new__):
+    vec = _new(Vector2)
+    vec.x = x
+    vec.y = y
+    return vec
+
+
+class Vector2Array:
+    """
+    A batch of 2D vectors backed by an (n, 2) float numpy array.
+
+    Mirrors the Vector2 API element-wise: arithmetic with another
+    Vector2Array or a single Vector2 broadcasts, `*` between vectors is the
+    per-element dot product, and rect() turns pairs of corners into a list
+    of pygame.Rect exactly like Vector2.rect.
+    """
+    
+    __slots__ = ("data",)
+    # Makes numpy return NotImplemented from its operators, so that scalars and
+    # arrays on the left go through the reflected ones (__rmul__ etc.) here
+    __array_ufunc__ = None
+    
+    def __init__(self, *args):
+        assert np is not None, "Vector2Array requires numpy"
+        if len(args) == 0:
+            self.data = np.zeros((0, 2))
+        elif len(args) == 1:
+            arg = args[0]
+            if isinstance(arg, Vector2Array):
+                self.data = arg.data.copy()
+            elif isinstance(arg, np.ndarray):
+                self.data = np.array(arg, dtype=float).reshape(-1, 2)
+            else:
+                self.data = np.array([(v.x, v.y) if isinstance(v, Vector2) else v for v in arg],
+                                     dtype=float).reshape(-1, 2)
+        elif len(args) == 2:
+            self.data = np.stack([np.asarray(args[0], dtype=float), np.asarray(args[1], dtype=float)], axis=-1)
+        else:
+            assert False
+    
+    @staticmethod
+    def _wrap(data):
+        arr = object.__new__(Vector2Array)
+        arr.data = data
+        return arr
+    
+    @staticmethod
+    def _operand(other):
+        if isinstance(other, Vector2Array):
+            return other.data
+        if isinstance(other, Vector2):
+            return np.array((other.x, other.y))
+        return None
+    
+    @property
+    def x(self):
+        return self.data[:, 0]
+    
+    @property
+    def y(self):
+        return self.data[:, 1]
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            x, y = self.data[idx]
+            return _newVector2(float(x), float(y))
+        return Vector2Array._wrap(self.data[idx])
+    
+    def __iter__(self):
+        for x, y in self.data.tolist():
+            yield _newVector2(x, y)
+    
+    def __repr__(self):
+        return "Vector2Array({})".format(self.data.tolist())
+    
+    def tuples(self):
+        return list(map(tuple, self.data.tolist()))
+    
+    def copy(self):
+        return Vector2Array._wrap(self.data.copy())
+    
+    def __abs__(self):
+        return np.hypot(self.data[:, 0], self.data[:, 1])
+    
+    def normalize(self):
+        return Vector2Array._wrap(self.data * (1 / abs(self))[:, None])
+    
+    def lerp(self, other, time=0.5):
+        return self * (1 - time) + other * time
+    
+    def _rotate(self, sin, cos, rel=None):
+        if rel is not None:
+            return (self - rel)._rotate(sin, cos) + rel
+        x, y = self.data[:, 0], self.data[:, 1]
+        return Vector2Array(x * cos - y * sin, x * sin + y * cos)
+    
+    def rotate(self, phi, rel=None):
+        return self._rotate(math.sin(phi), math.cos(phi), rel=rel)
+    
+    def rotate90(self, rel=None):
+        if rel is not None:
+            return (self - rel).rotate90() + rel
+        return Vector2Array(-self.data[:, 1], self.data[:, 0])
+    
+    def clamp(self, rect, loop=True):
+        origin = np.array((rect.x, rect.y))
+        if loop:
+            return Vector2Array._wrap(np.mod(self.data - origin, (rect.width, rect.height)) + origin)
+        return Vector2Array._wrap(np.clip(self.data, origin, (rect.right, rect.bottom)))
+    
+    @staticmethod
+    def rect(v1, v2):
+        p1 = np.round(v1.data)
+        p2 = np.round(v2.data)
+        corner = np.minimum(p1, p2).astype(int)
+        size = np.abs(np.round(v2.data - v1.data)).astype(int)
+        return [pygame.Rect(x, y, w, h) for (x, y), (w, h) in zip(corner.tolist(), size.tolist())]
+    
+    # ===[ Operators ]===
+    
+    def __add__(self, other):
+        data = Vector2Array._operand(other)
+        if data is None:
+            return NotImplemented
+        return Vector2Array._wrap(self.data + data)
+    
+    __radd__ = __add__
+    
+    def __sub__(self, other):
+        data = Vector2Array._operand(other)
+        if data is None:
+            return NotImplemented
+        return Vector2Array._wrap(self.data - data)
+    
+    def __rsub__(self, other):
+        data = Vector2Array._operand(other)
+        if data is None:
+            return NotImplemented
+        return Vector2Array._wrap(data - self.data)
+    
+    def __mul__(self, other):
+        data = Vector2Array._operand(other)
+        if data is not None:
+            return (self.data * data).sum(axis=-1)
+        if isinstance(other, (int, float, np.number)):
+            return Vector2Array._wrap(self.data * other)
+        if isinstance(other, np.ndarray):
+            return Vector2Array._wrap(self.data * other.reshape(-1, 1))
+        return NotImplemented
+    
+    __rmul__ = __mul__
+    
+    def __matmul__(self, other):
+        data = Vector2Array._operand(other)
+        if data is None:
+            return NotImplemented
+        return self.data[:, 0] * data[..., 1] + self.data[:, 1] * data[..., 0]
+    
+    def __truediv__(self, other):
+        if isinstance(other, (int, float, np.number)):
+            return self * (1 / other)
+        if isinstance(other, np.ndarray):
+            return self * (1 / other)
+        return NotImplemented
+    
+    def __neg__(self):
+        return Vector2Array._wrap(-self.data)
+    
+    def __pos__(self):
+        return self.copy()
+    
+    def __eq__(self, other):
+        if not isinstance(other, Vector2Array):
+            return NotImplemented
+        return self.data.shape == other.data.shape and bool((self.data == other.data).all())
+    
+    def __ne__(self, other):
+        return not self == other
+
+
 #class IndexedContainer:
 #    def __init__(self):
 #        self.elements = {}
@@ -208,7 +443,10 @@ class Component:
 class GameObject:
     def __init__(self, name=None):
         self.name = name
-        self.components = set()
+        self.components = []
+        # Every class in a component's MRO -> its components of that type, in insertion order
+        self._componentIndex = {}
+        self._transform = None
         self.tags = set()
     
     def instantiate(self, parent, *args, **kwargs):
@@ -216,7 +454,7 @@ class GameObject:
     
     @property
     def transform(self):
-        return self.getComponent(Transform)
+        return self._transform
     
     def destroy(self):
         pass  # TODO!
@@ -257,34 +495,58 @@ class GameObject:
     def broadcastMessage(self, msg, *args, targetComponent=Component, **kwargs):
         self.transform.broadcastMessage(msg, *args, targetComponent=targetComponent, **kwargs)
     
+    def getComponentsInChildren(self, type=Component):
+        return self.transform.getComponentsInChildren(type)
+    
     def addComponent(self, comp, *args, **kwargs):
         comp = comp(self, *args, **kwargs)
         assert isinstance(comp, Component)
-        self.components.add(comp)
+        self.components.append(comp)
+        for cls in comp.__class__.__mro__[:-1]:
+            self._componentIndex.setdefault(cls, []).append(comp)
+        if self._transform is None and isinstance(comp, Transform):
+            self._transform = comp
+        self._invalidateDispatch()
     
     def removeComponent(self, comp):
         assert isinstance(comp, Component)
-        self.components.discard(comp)
+        if comp not in self.components:
+            return
+        self._invalidateDispatch()
+        self.components.remove(comp)
+        for cls in comp.__class__.__mro__[:-1]:
+            self._componentIndex[cls].remove(comp)
+        if comp is self._transform:
+            transforms = self._componentIndex.get(Transform)
+            self._transform = transforms[0] if transforms else None
     
     def clearComponents(self):
+        self._invalidateDispatch()
         self.components.clear()
+        self._componentIndex.clear()
+        self._transform = None
+    
+    def _invalidateDispatch(self):
+        if self._transform is not None:
+            self._transform._invalidateDispatch()
     
     def getComponents(self, type=Component):
-        res = []
-        for comp in self.components:
-            if isinstance(comp, type):
-                res.append(comp)
-        return res
+        return list(self._componentIndex.get(type, ()))
     
     def getComponent(self, type=Component):
-        for comp in self.components:
-            if isinstance(comp, type):
-                return comp
-        assert False
+        comps = self._componentIndex.get(type)
+        assert comps
+        return comps[0]
     
     def handleMessage(self, msg, *args, targetComponent=Component, **kwargs):
         handler = "on_{}".format(msg)
         #print(self.name, handler)
+        profiler = Profiler.active
+        if profiler is not None:
+            handlers = [getattr(comp, handler) for comp in self.getComponents(targetComponent)
+                        if hasattr(comp, handler)]
+            profiler.dispatch(msg, handlers, args, kwargs)
+            return
         for comp in self.getComponents(targetComponent):
             if hasattr(comp, handler):
                 getattr(comp, handler)(*args, **kwargs)
@@ -293,32 +555,69 @@ class GameObject:
 class Transform(Component):
     def __init__(self, gameObject, parent=None, pos=(0, 0), priority=0):
         super().__init__(gameObject)
-        self.priority = priority
-        self.pos = Vector2(pos)
+        # (msg, targetComponent) -> flat, ordered list of bound handlers for this subtree
+        self._dispatchCache = {}
+        self._priority = priority
         self.parent = None
-        self.assignParent(parent)
         self.children = set()
+        # World position cache; dirty implies every descendant is dirty as well
+        self._worldPos = None
+        self._dirty = True
+        self.pos = Vector2(pos)
+        self.assignParent(parent)
+    
+    @property
+    def pos(self):
+        return self._pos
+    
+    @pos.setter
+    def pos(self, value):
+        # Reassign rather than mutate in place (e.g. iadd_), or the cache won't notice
+        self._pos = value
+        self._markDirty()
+    
+    def _markDirty(self):
+        if self._dirty:
+            return
+        self._dirty = True
+        for child in self.children:
+            child._markDirty()
+    
+    @property
+    def priority(self):
+        return self._priority
+    
+    @priority.setter
+    def priority(self, value):
+        self._priority = value
+        if self.parent is not None:
+            self.parent._invalidateDispatch()
     
     def assignParent(self, parent):
         if self.parent is not None:
             self.parent.removeChild(self)
         if parent is None:
             self.parent = None
+            self._markDirty()
             return
         assert isinstance(parent, Transform)
         parent.addChild(self)
         self.parent = parent
+        self._markDirty()
     
     def addChild(self, child):
         assert isinstance(child, Transform)
         self.children.add(child)
+        self._invalidateDispatch()
     
     def removeChild(self, child):
         assert isinstance(child, Transform)
         self.children.discard(child)
+        self._invalidateDispatch()
     
     def clearChildren(self):
         self.children.clear()
+        self._invalidateDispatch()
     
     def getChildren(self):
         return sorted(self.children, key=lambda x: x.priority)
@@ -351,17 +650,66 @@ class Transform(Component):
         return ans
     
     def broadcastMessage(self, msg, *args, targetComponent=Component, **kwargs):
-        self.gameObject.handleMessage(msg, *args, targetComponent=targetComponent, **kwargs)
+        # Objects added while a broadcast is in flight receive it from the next one on
+        handlers = self._dispatchCache.get((msg, targetComponent))
+        if handlers is None:
+            handlers = self._compileDispatch(msg, targetComponent)
+        profiler = Profiler.active
+        if profiler is not None:
+            profiler.dispatch(msg, handlers, args, kwargs)
+            return
+        for handler in handlers:
+            handler(*args, **kwargs)
+    
+    def _compileDispatch(self, msg, targetComponent):
+        name = "on_{}".format(msg)
+        handlers = []
+        for comp in self.gameObject.getComponents(targetComponent):
+            handler = getattr(comp, name, None)
+            if handler is not None:
+                handlers.append(handler)
+        for child in self.getChildren():
+            childHandlers = child._dispatchCache.get((msg, targetComponent))
+            if childHandlers is None:
+                childHandlers = child._compileDispatch(msg, targetComponent)
+            handlers.extend(childHandlers)
+        self._dispatchCache[(msg, targetComponent)] = handlers
+        return handlers
+    
+    def getComponentsInChildren(self, type=Component):
+        return list(self._componentsInChildren(type))
+    
+    def _componentsInChildren(self, type):
+        # Shares the dispatch cache (and its invalidation) under a `None` message
+        comps = self._dispatchCache.get((None, type))
+        if comps is not None:
+            return comps
+        comps = self.gameObject.getComponents(type)
         for child in self.getChildren():
-            child.broadcastMessage(msg, *args, targetComponent=targetComponent, **kwargs)
+            comps.extend(child._componentsInChildren(type))
+        self._dispatchCache[(None, type)] = comps
+        return comps
+    
+    def _invalidateDispatch(self):
+        # A subtree's lists are always compiled together with its ancestors',
+        # so an empty cache means everything above is already empty too
+        node = self
+        while node is not None and node._dispatchCache:
+            node._dispatchCache.clear()
+            node = node.parent
     
     def getPosition(self):
         return self.pos  # ?.copy()
     
     def getAbsolutePosition(self):
+        if not self._dirty:
+            return self._worldPos
         if self.parent is None:
-            return self.getPosition()
-        return self.getPosition() + self.parent.getAbsolutePosition()
+            self._worldPos = self._pos
+        else:
+            self._worldPos = self._pos + self.parent.getAbsolutePosition()
+        self._dirty = False
+        return self._worldPos
     
     def getRelativePosition(self, other):
         return self.getAbsolutePosition() - other.getAbsolutePosition()
@@ -387,9 +735,55 @@ class Texture(Component):
     def __init__(self, gameObject, zIndex=0):
         super().__init__(gameObject)
         self.zIndex = zIndex
+        # (color, rect tuple) drawn this and last frame; only tracked in dirty-rect mode
+        self.rects = None
+        self.prevRects = None
     
     def draw(self, drawBuf, color, rect):
-        drawBuf.append((color, rect, self.zIndex))
+        # The queue and the renderer key on the color, so anything fill() accepts
+        # (names, pygame.Color, lists...) is made a hashable RGBA tuple first
+        if color.__class__ is not tuple and not isinstance(color, pygame.Surface):
+            color = tuple(pygame.Color(color))
+        drawBuf.add(color, rect, self.zIndex)
+        if self.rects is not None:
+            self.rects.append((color, tuple(rect)))
+    
+    def beginFrame(self):
+        self.prevRects = self.rects or []
+        self.rects = []
+    
+    def getDirtyRects(self):
+        # Pixels covered by this texture both last frame and now (in the same color)
+        # didn't change, so each removed or added rect only counts minus the other side
+        prev = set(self.prevRects)
+        cur = set(self.rects)
+        if prev == cur:
+            return []
+        removed = [pygame.Rect(rect) for _, rect in prev - cur]
+        added = [pygame.Rect(rect) for _, rect in cur - prev]
+        return subtractRects(removed, added) + subtractRects(added, removed)
+
+
+def subtractRects(rects, others):
+    # Pieces of `rects` not covered by any of `others`, up to 4 per cut
+    for other in others:
+        pieces = []
+        for rect in rects:
+            if not rect.colliderect(other):
+                pieces.append(rect)
+                continue
+            if rect.top < other.top:
+                pieces.append(pygame.Rect(rect.left, rect.top, rect.width, other.top - rect.top))
+            if other.bottom < rect.bottom:
+                pieces.append(pygame.Rect(rect.left, other.bottom, rect.width, rect.bottom - other.bottom))
+            top = max(rect.top, other.top)
+            height = min(rect.bottom, other.bottom) - top
+            if rect.left < other.left:
+                pieces.append(pygame.Rect(rect.left, top, other.left - rect.left, height))
+            if other.right < rect.right:
+                pieces.append(pygame.Rect(other.right, top, rect.right - other.right, height))
+        rects = pieces
+    return rects
 
 
 class BoxTexture(Texture):
@@ -407,7 +801,43 @@ class BoxTexture(Texture):
         self.draw(drawBuf, self.color, self.getRect())
 
 
+def sweepRect(rect, delta, target):
+    # Earliest fraction t in [0, 1] of the move `rect` -> `rect` + `delta` at which it
+    # overlaps `target` (colliderect's sense: touching edges don't count), or None
+    if not (rect.width and rect.height and target.width and target.height):
+        return None
+    enter, exit = 0.0, 1.0
+    for start, end, size, otherStart, otherEnd in ((rect.left, rect.right, delta[0], target.left, target.right),
+                                                   (rect.top, rect.bottom, delta[1], target.top, target.bottom)):
+        if size == 0:
+            if not (start < otherEnd and otherStart < end):
+                return None
+            continue
+        first = (otherStart - end) / size
+        last = (otherEnd - start) / size
+        if size < 0:
+            first, last = last, first
+        enter = max(enter, first)
+        exit = min(exit, last)
+    if enter >= exit:
+        return None
+    return enter
+
+
 class Collider(Component):
+    ALL_LAYERS = -1
+    
+    def __init__(self, gameObject, layer=1, mask=ALL_LAYERS):
+        super().__init__(gameObject)
+        self.layer = layer
+        self.mask = mask
+    
+    def getBounds(self):
+        raise NotImplementedError()
+    
+    def canCollide(self, other):
+        return bool(self.layer & other.mask) and bool(other.layer & self.mask)
+    
     @staticmethod
     def collide(first, second):
         assert isinstance(first, Collider)
@@ -419,66 +849,1052 @@ class Collider(Component):
         if res is not NotImplemented:
             return res
         raise NotImplementedError()
+    
+    def _sweep(self, other, delta):
+        return NotImplemented
+    
+    @staticmethod
+    def sweep(first, second, delta):
+        # `first` has just moved by the integer `delta` to where it is now, with `second`
+        # standing still: the earliest fraction of that move at which they touched, or None
+        assert isinstance(first, Collider)
+        assert isinstance(second, Collider)
+        res = first._sweep(second, delta)
+        if res is not NotImplemented:
+            return res
+        res = second._sweep(first, (-delta[0], -delta[1]))
+        if res is not NotImplemented:
+            return res
+        raise NotImplementedError()
 
 
 class BoxCollider(Collider):
-    def __init__(self, gameObject, size, offset=(0, 0)):
-        super().__init__(gameObject)
+    def __init__(self, gameObject, size, offset=(0, 0), layer=1, mask=Collider.ALL_LAYERS):
+        super().__init__(gameObject, layer=layer, mask=mask)
         self.offset = Vector2(offset)
         self.size = size
+        # (world position, offset, size, rect) of the last getRect; the position is
+        # the Transform's cached Vector2, which is replaced whenever it moves
+        self._rectCache = None
     
     def getRect(self):
-        pos = round(self.gameObject.transform.getAbsolutePosition() + self.offset)
-        return pygame.Rect(pos.tuple(), self.size)
+        worldPos = self.gameObject.transform.getAbsolutePosition()
+        cache = self._rectCache
+        if cache is not None and cache[0] is worldPos and cache[1] is self.offset and cache[2] == self.size:
+            return pygame.Rect(cache[3])
+        pos = round(worldPos + self.offset)
+        rect = pygame.Rect(pos.tuple(), self.size)
+        self._rectCache = (worldPos, self.offset, self.size, rect)
+        return pygame.Rect(rect)
+    
+    def getBounds(self):
+        return self.getRect()
     
     def _collide(self, other):
         if not isinstance(other, BoxCollider):
             return NotImplemented
         return self.getRect().colliderect(other.getRect())
+    
+    def _sweep(self, other, delta):
+        if not isinstance(other, BoxCollider):
+            return NotImplemented
+        return sweepRect(self.getRect().move(-delta[0], -delta[1]), delta, other.getRect())
+
+
+class FreeCellSet:
+    """
+    The free cells of an n-cell board. Free cells are packed at the front of
+    `cells` and `index` maps each cell to its slot, so add and remove are a
+    swap with the boundary: add, remove, membership and uniform sampling
+    are all O(1), however full the board is. Every cell starts out free.
+    """
+    
+    def __init__(self, size):
+        self.cells = array("i", range(size))
+        self.index = array("i", range(size))
+        self.count = size
+    
+    def __len__(self):
+        return self.count
+    
+    def __contains__(self, cell):
+        return self.index[cell] < self.count
+    
+    def _swap(self, cell, slot):
+        cells, index = self.cells, self.index
+        other = cells[slot]
+        cells[index[cell]], cells[slot] = other, cell
+        index[other], index[cell] = index[cell], slot
+    
+    def remove(self, cell):
+        if self.index[cell] < self.count:
+            self.count -= 1
+            self._swap(cell, self.count)
+    
+    def add(self, cell):
+        if self.index[cell] >= self.count:
+            self._swap(cell, self.count)
+            self.count += 1
+    
+    def sample(self, rng):
+        assert self.count, "No free cells"
+        return self.cells[rng.randrange(self.count)]
+    
+    def clear(self):
+        # Frees every cell again
+        self.count = len(self.cells)
+    
+    def toBytes(self):
+        # The slot order matters to sample(), so it is saved along with the count
+        return struct.pack("<I", self.count) + self.cells.tobytes()
+    
+    def loadBytes(self, data, offset=0):
+        self.count, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        size = len(self.cells) * self.cells.itemsize
+        self.cells = array("i")
+        self.cells.frombytes(data[offset:offset + size])
+        for slot, cell in enumerate(self.cells):
+            self.index[cell] = slot
+        return offset + size
+
+
+class SpatialGrid:
+    """
+    Uniform grid hashing items by the cells their rects overlap. Given the
+    `bounds` (width, height) of the area in use, it also keeps the cells
+    inside them that hold nothing in `free`, a FreeCellSet of cy * cols + cx.
+    """
+    
+    def __init__(self, cellSize=64, bounds=None):
+        self.cellSize = cellSize
+        self.buckets = {}
+        if bounds is not None:
+            self.cols = -(-bounds[0] // cellSize)
+            self.rows = -(-bounds[1] // cellSize)
+            self.free = FreeCellSet(self.cols * self.rows)
+        else:
+            self.cols = self.rows = 0
+            self.free = None
+    
+    def cellRange(self, rect):
+        size = self.cellSize
+        return rect.left // size, (rect.right - 1) // size + 1, rect.top // size, (rect.bottom - 1) // size + 1
+    
+    def cells(self, rect):
+        x0, x1, y0, y1 = self.cellRange(rect)
+        for cx in range(x0, x1):
+            for cy in range(y0, y1):
+                yield cx, cy
+    
+    def cellIndex(self, cell):
+        # Index of an in-bounds cell in `free`, or -1
+        cx, cy = cell
+        if 0 <= cx < self.cols and 0 <= cy < self.rows:
+            return cy * self.cols + cx
+        return -1
+    
+    def _add(self, cell, item):
+        bucket = self.buckets.get(cell)
+        if bucket is None:
+            self.buckets[cell] = bucket = set()
+            if self.free is not None and self.cellIndex(cell) >= 0:
+                self.free.remove(self.cellIndex(cell))
+        bucket.add(item)
+    
+    def _discard(self, cell, item):
+        bucket = self.buckets[cell]
+        bucket.discard(item)
+        if not bucket:
+            del self.buckets[cell]
+            if self.free is not None and self.cellIndex(cell) >= 0:
+                self.free.add(self.cellIndex(cell))
+    
+    def insert(self, item, rect):
+        for cell in self.cells(rect):
+            self._add(cell, item)
+    
+    def remove(self, item, rect):
+        for cell in self.cells(rect):
+            self._discard(cell, item)
+    
+    def move(self, item, oldRect, newRect):
+        # Touches only the cells that differ; free while the rect stays in the same cells
+        if self.cellRange(oldRect) == self.cellRange(newRect):
+            return
+        oldCells = set(self.cells(oldRect))
+        newCells = set(self.cells(newRect))
+        for cell in oldCells - newCells:
+            self._discard(cell, item)
+        for cell in newCells - oldCells:
+            self._add(cell, item)
+    
+    def query(self, rect):
+        res = set()
+        for cell in self.cells(rect):
+            bucket = self.buckets.get(cell)
+            if bucket:
+                res |= bucket
+        return res
+    
+    def clear(self):
+        self.buckets.clear()
+        if self.free is not None:
+            self.free.clear()
+
+
+class CollisionWorld:
+    """
+    Uniform-grid broadphase over every Collider in a scene.
+
+    update() re-reads the scene's colliders (cached until the tree changes),
+    computes each bounding rect once, buckets them into `cellSize` cells and
+    only narrowphase-tests pairs that share a cell and whose layer masks
+    match. Contacts are reported to both game objects as collision_enter,
+    collision_stay and collision_exit messages carrying the other collider.
+    """
+    
+    def __init__(self, scene, cellSize=64):
+        self.scene = scene
+        self.cellSize = cellSize
+        self.contacts = {}
+        self.pairsTested = 0
+    
+    def _touching(self, first, second, firstRect, secondRect):
+        if not firstRect.colliderect(secondRect):
+            return False
+        if first.__class__ is BoxCollider and second.__class__ is BoxCollider:
+            return True  # The bounds are the shapes
+        try:
+            return Collider.collide(first, second)
+        except NotImplementedError:
+            return False
+    
+    def update(self):
+        colliders = self.scene.transform._componentsInChildren(Collider)
+        grid = SpatialGrid(self.cellSize)
+        bounds = []
+        for idx, collider in enumerate(colliders):
+            rect = collider.getBounds()
+            bounds.append(rect)
+            if rect is None or not rect.width or not rect.height:
+                continue
+            grid.insert(idx, rect)
+        
+        seen = set()
+        contacts = {}
+        for bucket in grid.buckets.values():
+            bucket = sorted(bucket)
+            for i in range(len(bucket)):
+                a = bucket[i]
+                for b in bucket[i + 1:]:
+                    if (a, b) in seen:
+                        continue
+                    seen.add((a, b))
+                    first, second = colliders[a], colliders[b]
+                    if first.gameObject is second.gameObject or not first.canCollide(second):
+                        continue
+                    if self._touching(first, second, bounds[a], bounds[b]):
+                        key = (id(first), id(second)) if id(first) < id(second) else (id(second), id(first))
+                        contacts[key] = (first, second)
+        self.pairsTested = len(seen)
+        
+        previous = self.contacts
+        self.contacts = contacts
+        for key, (first, second) in contacts.items():
+            msg = "collision_stay" if key in previous else "collision_enter"
+            first.gameObject.handleMessage(msg, second)
+            second.gameObject.handleMessage(msg, first)
+        for key, (first, second) in previous.items():
+            if key not in contacts:
+                first.gameObject.handleMessage("collision_exit", second)
+                second.gameObject.handleMessage("collision_exit", first)
+
+
+class RenderQueue:
+    """
+    Persistent draw queue, replacing the per-frame list of (color, rect, zIndex).
+
+    Commands go into one bucket per (zIndex, color), and `order` lists the
+    buckets as (zIndex, color, rects) in zIndex order. Buckets are reused
+    across frames and only emptied in place by clear(), so ordering is
+    re-established only when a new bucket appears. Buckets that stay empty
+    for a whole frame are dropped.
+    """
+    
+    def __init__(self):
+        self.buckets = {}
+        self.order = []
+    
+    def add(self, color, rect, zIndex):
+        try:
+            self.buckets[zIndex, color].append(rect)
+        except KeyError:
+            self.buckets[zIndex, color] = [rect]
+            self.order.append((zIndex, color, self.buckets[zIndex, color]))
+            self.order.sort(key=lambda bucket: bucket[0])
+    
+    def clear(self):
+        if not all(rects for _, _, rects in self.order):
+            self.order = [bucket for bucket in self.order if bucket[2]]
+            self.buckets = {(zIndex, color): rects for zIndex, color, rects in self.order}
+        for _, _, rects in self.order:
+            rects.clear()
+    
+    def __len__(self):
+        return sum(len(rects) for _, _, rects in self.order)
+    
+    def __iter__(self):
+        for zIndex, color, rects in self.order:
+            for rect in rects:
+                yield color, rect, zIndex
+
+
+class Renderer:
+    """
+    Draws a RenderQueue onto a target surface.
+
+    Each (zIndex, color) batch goes out as a single blits() call. A color is
+    drawn by blitting the matching area of a cached solid surface of that
+    color (in the target's pixel format, or per-pixel alpha for translucent
+    colors), which on SDL is cheaper than fill() per rect. The cache keeps
+    the `cacheSize` most recently used colors, each only as large as the
+    biggest rect drawn in it. A Surface given as the color is blitted as a
+    texture. Within a layer, commands sharing a color are drawn together,
+    in submission order.
+    """
+    
+    def __init__(self, cacheSize=16):
+        self.surfaceCache = {}
+        self.cacheSize = cacheSize
+        self.commands = 0
+        self.batches = 0
+        self.renderTime = 0.0
+    
+    def _colorSurface(self, target, color, width, height):
+        # The cache dict is kept in least to most recently used order
+        cache = self.surfaceCache
+        surface = cache.pop(color, None)
+        if surface is None or surface.get_width() < width or surface.get_height() < height:
+            if surface is not None:
+                width = max(width, surface.get_width())
+                height = max(height, surface.get_height())
+            if pygame.Color(color).a < 255:
+                surface = pygame.Surface((width, height), pygame.SRCALPHA)
+            else:
+                surface = pygame.Surface((width, height), 0, target)
+            surface.fill(color)
+        cache[color] = surface
+        if len(cache) > self.cacheSize:
+            del cache[next(iter(cache))]
+        return surface
+    
+    def fillRects(self, target, color, rects):
+        if not rects:
+            return
+        width = max(rect.width for rect in rects)
+        height = max(rect.height for rect in rects)
+        surface = self._colorSurface(target, color, width, height)
+        target.blits([(surface, rect, (0, 0, rect.width, rect.height)) for rect in rects], doreturn=False)
+    
+    def render(self, target, queue, clip=None):
+        # With `clip`, only the parts of commands inside those rects are drawn
+        startTime = time.perf_counter()
+        commands = batches = 0
+        for _, color, rects in queue.order:
+            if clip is not None:
+                parts = [(rect, rect.clip(clip[idx])) for rect in map(pygame.Rect, rects)
+                         for idx in rect.collidelistall(clip)]
+            elif rects:
+                parts = None
+            else:
+                continue
+            if isinstance(color, pygame.Surface):
+                if parts is None:
+                    target.blits([(color, rect) for rect in rects], doreturn=False)
+                else:
+                    target.blits([(color, part, part.move(-rect.x, -rect.y)) for rect, part in parts], doreturn=False)
+            else:
+                self.fillRects(target, color, rects if parts is None else [part for _, part in parts])
+            count = len(rects) if parts is None else len(parts)
+            commands += count
+            batches += count > 0
+        self.commands = commands
+        self.batches = batches
+        self.renderTime = time.perf_counter() - startTime
+
+
+class ProfileStat:
+    __slots__ = ("count", "total", "max")
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class ProfileSection:
+    __slots__ = ("stat", "startTime")
+    
+    def __init__(self, stat):
+        self.stat = stat
+    
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+    
+    def __exit__(self, *exc):
+        self.stat.add(time.perf_counter() - self.startTime)
+
+
+class Profiler:
+    """
+    Opt-in frame loop profiler. While a profiler is `Profiler.active`, every
+    broadcast and handleMessage is timed per message and per (component
+    class, message), Scene.run times its phases, and the last `window` frame
+    times are kept for percentiles. Times are inclusive: a message sent from
+    inside a handler counts towards both. When no profiler is active, the
+    hooks cost one attribute lookup per broadcast.
+    """
+    
+    active = None
+    
+    def __init__(self, window=600):
+        self.messages = {}
+        self.components = {}
+        self.phases = {}
+        self.frameTimes = deque(maxlen=window)
+        self._lastFrame = None
+    
+    def enable(self):
+        Profiler.active = self
+        self._lastFrame = None
+        return self
+    
+    def disable(self):
+        if Profiler.active is self:
+            Profiler.active = None
+    
+    def __enter__(self):
+        return self.enable()
+    
+    def __exit__(self, *exc):
+        self.disable()
+    
+    @staticmethod
+    def _stat(table, key):
+        stat = table.get(key)
+        if stat is None:
+            stat = table[key] = ProfileStat()
+        return stat
+    
+    @staticmethod
+    def section(name):
+        # `with Profiler.section(name):` times a phase of the active profiler, if any
+        profiler = Profiler.active
+        if profiler is None:
+            return _NO_SECTION
+        return ProfileSection(Profiler._stat(profiler.phases, name))
+    
+    def dispatch(self, msg, handlers, args, kwargs):
+        clock = time.perf_counter
+        components = self.components
+        startTime = clock()
+        for handler in handlers:
+            handlerStart = clock()
+            handler(*args, **kwargs)
+            key = (handler.__self__.__class__, msg)
+            stat = components.get(key)
+            if stat is None:
+                stat = components[key] = ProfileStat()
+            stat.add(clock() - handlerStart)
+        self._stat(self.messages, msg).add(clock() - startTime)
+    
+    def frame(self):
+        # Called once per frame; records the time since the previous call
+        now = time.perf_counter()
+        if self._lastFrame is not None:
+            self.frameTimes.append(now - self._lastFrame)
+        self._lastFrame = now
+    
+    def percentiles(self, ranks=(50, 90, 99)):
+        # Nearest-rank percentiles of the recent frame times, in seconds
+        times = sorted(self.frameTimes)
+        if not times:
+            return {rank: 0.0 for rank in ranks}
+        return {rank: times[min(len(times) - 1, max(0, math.ceil(rank / 100 * len(times)) - 1))]
+                for rank in ranks}
+    
+    def rows(self):
+        # (kind, name, count, total ms, mean ms, max ms), slowest first within each kind
+        tables = (
+            ("phase", {name: stat for name, stat in self.phases.items()}),
+            ("message", {name: stat for name, stat in self.messages.items()}),
+            ("component", {"{}.on_{}".format(cls.__name__, msg): stat
+                           for (cls, msg), stat in self.components.items()}),
+        )
+        res = []
+        for kind, table in tables:
+            for name, stat in sorted(table.items(), key=lambda item: -item[1].total):
+                if not stat.count:
+                    continue  # A section still in progress
+                res.append((kind, name, stat.count, stat.total * 1000,
+                            stat.total / stat.count * 1000, stat.max * 1000))
+        return res
+    
+    def toDict(self):
+        res = {"frames": len(self.frameTimes),
+               "frameTime": {"p{}".format(rank): value * 1000 for rank, value in self.percentiles().items()}}
+        for kind, name, count, total, mean, max in self.rows():
+            res.setdefault(kind + "s", {})[name] = {"count": count, "total": total, "mean": mean, "max": max}
+        return res
+    
+    def toJSON(self, file):
+        json.dump(self.toDict(), file, indent=2)
+    
+    def toCSV(self, file):
+        writer = csv.writer(file)
+        writer.writerow(("kind", "name", "count", "total_ms", "mean_ms", "max_ms"))
+        writer.writerows(self.rows())
+        for rank, value in self.percentiles().items():
+            writer.writerow(("frame", "p{}".format(rank), len(self.frameTimes), "", value * 1000, ""))
+    
+    def export(self, path):
+        with open(path, "w", newline="") as file:
+            if path.endswith(".csv"):
+                self.toCSV(file)
+            else:
+                self.toJSON(file)
+
+
+_NO_SECTION = contextlib.nullcontext()
+
+
+class ProfilerOverlay(Texture):
+    """
+    Draws the active profiler's frame percentiles, phases and slowest
+    handlers in a corner. The text is re-rendered every `interval` seconds.
+    """
+    
+    def __init__(self, gameObject, zIndex=1000, pos=(4, 4), interval=0.5, lines=6, fontSize=16,
+                 color=(255, 255, 0)):
+        super().__init__(gameObject, zIndex=zIndex)
+        self.pos = pos
+        self.interval = interval
+        self.lines = lines
+        self.fontSize = fontSize
+        self.color = color
+        self.font = None
+        self.surface = None
+        self._lastUpdate = None
+    
+    def getLines(self, profiler):
+        pct = profiler.percentiles()
+        res = ["frame p50 {:.2f} p90 {:.2f} p99 {:.2f} ms".format(pct[50] * 1000, pct[90] * 1000, pct[99] * 1000)]
+        scene = self.gameObject.getRoot()
+        if isinstance(scene, Scene):
+            res.append("fps {fps:.1f}/{targetFps:g} ticks {tickRate:.1f}/{targetTickRate:.1f}".format(**scene.getRates()))
+        components = []
+        for kind, name, count, total, mean, max in profiler.rows():
+            if kind == "phase":
+                res.append("{} {:.3f} ms (max {:.2f})".format(name, mean, max))
+            elif kind == "component":
+                components.append("{} {:.3f} ms".format(name, mean))
+        return res + components[:self.lines]
+    
+    def _render(self, profiler):
+        if self.font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.font = pygame.font.Font(None, self.fontSize)
+        rendered = [self.font.render(line, True, self.color) for line in self.getLines(profiler)]
+        width = max(line.get_width() for line in rendered)
+        height = self.font.get_linesize()
+        surface = pygame.Surface((width, height * len(rendered)), pygame.SRCALPHA)
+        for i, line in enumerate(rendered):
+            surface.blit(line, (0, i * height))
+        return surface
+    
+    def on_draw(self, drawBuf):
+        profiler = Profiler.active
+        if profiler is None:
+            return
+        now = time.perf_counter()
+        if self.surface is None or now - self._lastUpdate >= self.interval:
+            self.surface = self._render(profiler)
+            self._lastUpdate = now
+        self.draw(drawBuf, self.surface, pygame.Rect(self.pos, self.surface.get_size()))
+
+
+ReplayEvent = namedtuple("ReplayEvent", "tick type key mod scancode unicode")
+
+
+class Replay:
+    """
+    A recorded session: the Scene's seed and fixed dt, plus every QUIT, KEYDOWN
+    and KEYUP event that went through Scene.handleEvent, stamped with the
+    tick it arrived before. That is enough to replay a deterministic game,
+    given `mode`: a number the game sets to tell apart the variants it can
+    play (0 by default).
+
+    Binary layout (little-endian): the header magic, version, seed, fixedDt
+    and mode, then one fixed-size record per event.
+    """
+    
+    MAGIC = b"SNRP"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHQdB")
+    # Version 1 had no mode, which reads as 0
+    HEADER_V1 = struct.Struct("<4sHQd")
+    RECORD = struct.Struct("<IBIHHI")
+    TYPES = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP)
+    
+    def __init__(self, seed, fixedDt, events=None, mode=0):
+        self.seed = seed
+        self.fixedDt = fixedDt
+        self.events = events if events is not None else []
+        self.mode = mode
+    
+    def record(self, tick, event):
+        if event.type not in self.TYPES:
+            return
+        key = getattr(event, "key", 0)
+        mod = getattr(event, "mod", 0)
+        scancode = getattr(event, "scancode", 0)
+        unicode = getattr(event, "unicode", "")
+        self.events.append(ReplayEvent(tick, self.TYPES.index(event.type), key, mod, scancode,
+                                       ord(unicode) if len(unicode) == 1 else 0))
+    
+    @staticmethod
+    def toEvent(record):
+        type = Replay.TYPES[record.type]
+        if type == pygame.QUIT:
+            return pygame.event.Event(type)
+        if type == pygame.KEYUP:
+            return pygame.event.Event(type, key=record.key, mod=record.mod, scancode=record.scancode)
+        return pygame.event.Event(type, key=record.key, mod=record.mod, scancode=record.scancode,
+                                  unicode=chr(record.unicode) if record.unicode else "")
+    
+    def toBytes(self):
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.fixedDt, self.mode)
+        return header + b"".join(self.RECORD.pack(*event) for event in self.events)
+    
+    @classmethod
+    def fromBytes(cls, data):
+        magic, version = struct.unpack_from("<4sH", data)
+        assert magic == cls.MAGIC, "Not a replay"
+        assert version in (1, cls.VERSION), "Unsupported replay version"
+        header = cls.HEADER_V1 if version == 1 else cls.HEADER
+        _, _, seed, fixedDt, *mode = header.unpack_from(data)
+        events = [ReplayEvent(*fields) for fields in cls.RECORD.iter_unpack(data[header.size:])]
+        return cls(seed, fixedDt, events, mode[0] if mode else 0)
+    
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.toBytes())
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.fromBytes(file.read())
+
+
+def subscribe(type, keys=None):
+    """
+    Marks a component method as a handler for pygame events of `type`,
+    optionally only those whose `key` is in `keys`. The handler gets the event.
+    """
+    def decorator(func):
+        func._subscriptions = getattr(func, "_subscriptions", ()) + ((type, None if keys is None else frozenset(keys)),)
+        return func
+    return decorator
+
+
+class EventBus:
+    """
+    Routes pygame events straight to their listeners instead of broadcasting
+    them through the scene graph.
+
+    Components in the scene listen through @subscribe-decorated methods, or
+    by defining `on_<event name>` (on_keydown, on_mousebuttondown,
+    on_videoresize, ...), which get the event too, except for the legacy
+    on_keydown(key, mod, unicode, scancode) and on_keyup(key, mod). The
+    routing table is rebuilt only after the scene graph changes, and each
+    (type, key) route is resolved once, so an event costs as much as its
+    listeners. Other code can subscribe(type, handler, keys) directly.
+    """
+    
+    _eventTypes = None
+    _classRoutes = {}
+    
+    def __init__(self, scene):
+        self.scene = scene
+        self.listeners = []
+        self._components = None
+        self._byType = {}
+        self._routes = {}
+    
+    @classmethod
+    def eventTypes(cls):
+        # "on_keydown" -> pygame.KEYDOWN, for every named event type
+        if cls._eventTypes is None:
+            cls._eventTypes = {}
+            for type in range(pygame.NUMEVENTS):
+                name = pygame.event.event_name(type)
+                if name not in ("Unknown", "NoEvent", "UserEvent"):
+                    cls._eventTypes.setdefault("on_" + name.lower(), type)
+        return cls._eventTypes
+    
+    @classmethod
+    def _getClassRoutes(cls, compClass):
+        # (type, keys, attribute name, legacy signature) for every listener a component class defines
+        routes = cls._classRoutes.get(compClass)
+        if routes is not None:
+            return routes
+        eventTypes = cls.eventTypes()
+        routes = []
+        for name in dir(compClass):
+            subscriptions = getattr(getattr(compClass, name, None), "_subscriptions", None)
+            if subscriptions is not None:
+                routes.extend((type, keys, name, False) for type, keys in subscriptions)
+            elif name in eventTypes:
+                routes.append((eventTypes[name], None, name, name in ("on_keydown", "on_keyup")))
+        cls._classRoutes[compClass] = routes
+        return routes
+    
+    @staticmethod
+    def _legacy(type, handler):
+        if type == pygame.KEYDOWN:
+            return lambda event: handler(event.key, event.mod, event.unicode, event.scancode)
+        return lambda event: handler(event.key, event.mod)
+    
+    def subscribe(self, type, handler, keys=None):
+        self.listeners.append((type, None if keys is None else frozenset(keys), handler))
+        self._components = None
+    
+    def unsubscribe(self, type, handler):
+        self.listeners = [listener for listener in self.listeners
+                          if not (listener[0] == type and listener[2] == handler)]
+        self._components = None
+    
+    def _compile(self, components):
+        byType = {}
+        for comp in components:
+            for type, keys, name, legacy in self._getClassRoutes(comp.__class__):
+                handler = getattr(comp, name)
+                byType.setdefault(type, []).append((keys, self._legacy(type, handler) if legacy else handler))
+        for type, keys, handler in self.listeners:
+            byType.setdefault(type, []).append((keys, handler))
+        self._components = components
+        self._byType = byType
+        self._routes = {}
+    
+    def getHandlers(self, type, key=None):
+        # The shared component list is replaced whenever the scene graph changes
+        components = self.scene.transform._componentsInChildren(Component)
+        if components is not self._components:
+            self._compile(components)
+        route = self._routes.get((type, key))
+        if route is None:
+            route = [handler for keys, handler in self._byType.get(type, ())
+                     if keys is None or key in keys]
+            self._routes[(type, key)] = route
+        return route
+    
+    def dispatch(self, event):
+        for handler in self.getHandlers(event.type, getattr(event, "key", None)):
+            handler(event)
+
+
+class FramePacer:
+    """
+    Paces a loop to `fps` frames per second by sleeping until each frame's
+    deadline, instead of spinning. Deadlines advance by whole frame periods,
+    so sleep overshoot doesn't accumulate into a lower rate. The last
+    `spin` seconds before a deadline are busy-waited for precision (off by
+    default). Achieved frame and tick rates are measured over `window`
+    seconds.
+    """
+    
+    def __init__(self, fps, spin=0.0, window=1.0):
+        self.fps = fps
+        self.spin = spin
+        self.window = window
+        self.frameRate = 0.0
+        self.tickRate = 0.0
+        self.reset()
+    
+    def reset(self):
+        # Forget the past, e.g. after idling, so the next frame isn't seen as late
+        now = time.perf_counter()
+        self._deadline = now
+        self._lastFrame = now
+        self._windowStart = now
+        self._frames = 0
+        self._ticks = 0
+    
+    def wait(self):
+        # Sleeps until the next frame is due; returns the ms since the previous frame
+        if self.fps:
+            self._deadline += 1 / self.fps
+            now = time.perf_counter()
+            if self._deadline < now:
+                self._deadline = now  # Late: start over rather than rushing to catch up
+            elif self._deadline - now > self.spin:
+                time.sleep(self._deadline - now - self.spin)
+            while time.perf_counter() < self._deadline:
+                pass
+        now = time.perf_counter()
+        elapsed = now - self._lastFrame
+        self._lastFrame = now
+        return elapsed * 1000
+    
+    def count(self, ticks):
+        # Called once per frame with the simulation steps it ran
+        self._frames += 1
+        self._ticks += ticks
+        elapsed = self._lastFrame - self._windowStart
+        if elapsed >= self.window:
+            self.frameRate = self._frames / elapsed
+            self.tickRate = self._ticks / elapsed
+            self._windowStart = self._lastFrame
+            self._frames = self._ticks = 0
 
 
 class Scene(GameObject):
-    def __init__(self, size=(800, 600), fpsLimit=1000, bgColor=(255, 255, 255)):
+    def __init__(self, size=(800, 600), fpsLimit=60, bgColor=(255, 255, 255), headless=False, fixedDt=None,
+                 collisions=False, dirtyRects=False, dirtyThreshold=0.5, seed=None, record=False, maxFrameSteps=5,
+                 vsync=False, pauseUnfocused=True, idleFps=10):
         super().__init__("Scene")
-        self.screen = pygame.display.set_mode(size)
-        self.clock = pygame.time.Clock()
+        self.headless = headless
+        self.vsync = False
+        if headless:
+            self.screen = pygame.Surface(size)
+        elif vsync:
+            try:
+                self.screen = pygame.display.set_mode(size, pygame.SCALED, vsync=1)
+                self.vsync = True
+            except pygame.error:  # No vsync-capable renderer
+                self.screen = pygame.display.set_mode(size)
+        else:
+            self.screen = pygame.display.set_mode(size)
+        # Frames are rendered at up to `fpsLimit`, and only when a tick or event may have
+        # changed something. With vsync the display's refresh rate caps them as well;
+        # the pacer still sleeps, in case the driver doesn't actually block on it
         self.fpsLimit = fpsLimit
-        self.bgColor = bgColor
-        self.drawBuf = []
+        self.pacer = FramePacer(fpsLimit)
+        # Out of focus the simulation pauses, and while minimized or hidden nothing
+        # is drawn; either way the loop just waits for events at `idleFps`
+        self.pauseUnfocused = pauseUnfocused
+        self.idleFps = idleFps
+        self.focused = True
+        self.visible = True
+        self.bgColor = tuple(pygame.Color(bgColor))
+        # Simulated milliseconds per step; headless scenes never look at the wall clock
+        if fixedDt is None and headless:
+            fixedDt = 1000 / fpsLimit
+        self.fixedDt = fixedDt
+        # With a fixed dt, run() advances the simulation by whole steps of simulated
+        # time, at most `maxFrameSteps` per frame, independently of the frame rate
+        self.maxFrameSteps = maxFrameSteps
+        self._accumulator = 0
+        self.dt = 0
+        self.tickCount = 0
+        # All game randomness goes through `random`, so a seed and the input fully determine a game
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.random = random.Random(seed)
+        if record:
+            assert fixedDt is not None, "Only fixed-dt scenes can be replayed"
+            self.replay = Replay(seed, fixedDt)
+        else:
+            self.replay = None
+        self.drawBuf = RenderQueue()
+        self.renderer = Renderer()
+        # Dirty-rect mode repaints only what changed, falling back to a full
+        # frame once the changed area passes `dirtyThreshold` of the screen
+        self.dirtyRects = dirtyRects
+        self.dirtyThreshold = dirtyThreshold
+        self.fullRedraw = True
+        self._drawnTextures = []
+        self.collisionWorld = CollisionWorld(self) if collisions else None
+        self.started = False
+        self.running = False
         self.addComponent(Transform)
+        self.events = EventBus(self)
+        for type, attr, value in ((pygame.WINDOWFOCUSGAINED, "focused", True),
+                                  (pygame.WINDOWFOCUSLOST, "focused", False),
+                                  (pygame.WINDOWRESTORED, "visible", True),
+                                  (pygame.WINDOWSHOWN, "visible", True),
+                                  (pygame.WINDOWMINIMIZED, "visible", False),
+                                  (pygame.WINDOWHIDDEN, "visible", False)):
+            self.events.subscribe(type, lambda event, attr=attr, value=value: setattr(self, attr, value))
     
     def handleEvent(self, event):
-        tr = self.transform
+        if self.replay is not None:
+            self.replay.record(self.tickCount, event)
+        self.events.dispatch(event)
         if event.type == pygame.QUIT:
             self.stop()
-        if event.type == pygame.KEYDOWN:
-            tr.broadcastMessage("keydown", event.key, event.mod, event.unicode, event.scancode)
-        if event.type == pygame.KEYUP:
-            tr.broadcastMessage("keyup", event.key, event.mod)
-        pass  # TODO: Implement the rest!!
+    
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.running = True
+        self.transform.broadcastMessage("start")
+    
+    def tick(self, dt):
+        self.dt = dt
+        self.transform.broadcastMessage("tick", self)
+        if self.collisionWorld is not None:
+            self.collisionWorld.update()
+        self.tickCount += 1
+    
+    def step(self, n=1):
+        self.start()
+        for _ in range(n):
+            if not self.running:
+                break
+            self.tick(self.fixedDt)
+    
+    def runUntil(self, predicate, maxSteps=None):
+        self.start()
+        steps = 0
+        while self.running and not predicate(self):
+            if maxSteps is not None and steps >= maxSteps:
+                break
+            self.tick(self.fixedDt)
+            steps += 1
+        return steps
+    
+    def playback(self, replay, maxTicks=None):
+        # Feeds the recorded events back in at their ticks, as fast as possible.
+        # The scene must have been built with the replay's seed and fixedDt
+        assert (self.seed, self.fixedDt) == (replay.seed, replay.fixedDt), "Scene doesn't match the replay"
+        self.start()
+        events = iter(replay.events)
+        pending = next(events, None)
+        while self.running and (maxTicks is None or self.tickCount < maxTicks):
+            while pending is not None and pending.tick <= self.tickCount:
+                self.handleEvent(Replay.toEvent(pending))
+                pending = next(events, None)
+            if not self.running:
+                break
+            self.tick(self.fixedDt)
+        return self.tickCount
+    
+    def isIdle(self):
+        return not self.visible or (self.pauseUnfocused and not self.focused)
+    
+    def getRates(self):
+        # Achieved vs target frame and simulation rates, per second
+        return {
+            "fps": self.pacer.frameRate,
+            "targetFps": self.fpsLimit,
+            "tickRate": self.pacer.tickRate,
+            "targetTickRate": 1000 / self.fixedDt if self.fixedDt else self.fpsLimit,
+        }
     
     def run(self):
+        if self.headless:
+            self.runUntil(lambda scene: False)
+            return
         tr = self.transform
-        tr.broadcastMessage("start")
-        while True:
-            self.clock.tick(self.fpsLimit)
-            #print(self.clock.get_fps())
-            self.drawBuf = []
-            for event in pygame.event.get():
-                self.handleEvent(event)
-            tr.broadcastMessage("tick", self)
-            self.screen.fill(self.bgColor)
-            tr.broadcastMessage("draw", self.drawBuf, targetComponent=Component)
+        pacer = self.pacer
+        self.start()
+        pacer.reset()
+        while self.running:
+            if self.isIdle():
+                with Profiler.section("idle"):
+                    event = pygame.event.wait(int(1000 / self.idleFps))
+                if event.type != pygame.NOEVENT:
+                    self.handleEvent(event)
+                if not self.isIdle():
+                    # Back: don't simulate the idle time, and repaint everything
+                    pacer.reset()
+                    self._accumulator = 0
+                    self.fullRedraw = True
+                continue
+            frameTime = pacer.wait()
+            profiler = Profiler.active
+            if profiler is not None:
+                profiler.frame()
+            self.drawBuf.clear()
+            with Profiler.section("events"):
+                events = pygame.event.get()
+                for event in events:
+                    self.handleEvent(event)
+            ticks = 0
+            with Profiler.section("tick"):
+                if self.fixedDt is None:
+                    self.tick(frameTime)
+                    ticks = 1
+                else:
+                    self._accumulator = min(self._accumulator + frameTime, self.fixedDt * self.maxFrameSteps)
+                    while self.running and self._accumulator >= self.fixedDt:
+                        self.tick(self.fixedDt)
+                        self._accumulator -= self.fixedDt
+                        ticks += 1
+            pacer.count(ticks)
+            if not (ticks or events or self.fullRedraw):
+                continue
+            with Profiler.section("draw"):
+                if self.dirtyRects:
+                    for texture in tr._componentsInChildren(Texture):
+                        texture.beginFrame()
+                tr.broadcastMessage("draw", self.drawBuf, targetComponent=Component)
             self.drawAll()
     
+    def _collectDirtyRects(self):
+        textures = self.transform._componentsInChildren(Texture)
+        dirty = []
+        for texture in textures:
+            dirty.extend(texture.getDirtyRects())
+        current = set(textures)
+        for texture in self._drawnTextures:
+            if texture not in current:
+                dirty.extend(pygame.Rect(rect) for _, rect in texture.rects or ())
+                texture.rects = texture.prevRects = None
+        self._drawnTextures = textures
+        return dirty
+    
     def drawAll(self):
-        for color, rect, _ in sorted(self.drawBuf, key=lambda x: x[2]):
-            surface = pygame.Surface(rect.size)
-            surface.fill(color)
-            self.screen.blit(surface, rect)
-        pygame.display.update()
+        with Profiler.section("render"):
+            dirty = self._render()
+        with Profiler.section("present"):
+            if dirty is None:
+                pygame.display.update()
+            elif dirty:
+                pygame.display.update(dirty)
+    
+    def _render(self):
+        # Returns the rects to present, or None for the whole screen
+        if self.dirtyRects:
+            dirty = self._collectDirtyRects()
+            screenRect = self.screen.get_rect()
+            dirty = [rect for rect in (rect.clip(screenRect) for rect in dirty) if rect.width and rect.height]
+            area = sum(rect.width * rect.height for rect in dirty)
+            if not self.fullRedraw and area <= self.dirtyThreshold * screenRect.width * screenRect.height:
+                if dirty:
+                    self.renderer.fillRects(self.screen, self.bgColor, dirty)
+                    self.renderer.render(self.screen, self.drawBuf, clip=dirty)
+                return dirty
+        self.fullRedraw = False
+        self.screen.fill(self.bgColor)
+        self.renderer.render(self.screen, self.drawBuf)
+        return None
     
     def stop(self):
+        self.running = False
+        if self.headless:
+            return
         pygame.quit()
         sys.exit()
 
@@ -0,0 +1,159 @@
+import pygame
+from engine import *
+from array import array
+
+
+class GridSnakeController(Behaviour):
+    """
+    Discrete snake: the field is a grid of `cellSize` cells, the body a ring
+    buffer of cell indices (y * cols + x, tail first) and the occupied cells
+    a bytearray, so a step is O(1): pop the tail, test one byte, push the head.
+    The snake advances one cell every `stepTime` ms of scene time. Up to
+    `foodCount` foods are out at once, placed on cells drawn from a
+    FreeCellSet of the cells holding neither snake nor food.
+    """
+    
+    def __init__(self, gameObject, cellSize=32, stepTime=200, startLength=4, wrap=False, foodCount=1):
+        super().__init__(gameObject)
+        self.cellSize = cellSize
+        self.stepTime = stepTime
+        self.startLength = startLength
+        self.wrap = wrap
+        self.foodCount = foodCount
+    
+    def on_start(self):
+        scene = self.gameObject.getRoot()
+        rect = scene.screen.get_rect()
+        self.cols = rect.width // self.cellSize
+        self.rows = rect.height // self.cellSize
+        self.random = scene.random
+        self.reset()
+        self.gameObject.addComponent(GridSnakeTexture)
+    
+    def reset(self):
+        cells = self.cols * self.rows
+        self.occupied = bytearray(cells)
+        self.free = FreeCellSet(cells)
+        self.body = array("i", bytes(4 * cells))
+        self.bodyStart = 0
+        self.length = 0
+        self.moveDir = (1, 0)
+        self.lastDir = (1, 0)
+        self.timer = 0
+        self.steps = 0
+        self.score = 0
+        self.deathCause = None
+        y = self.rows // 2
+        for x in range(self.startLength):
+            self._push(y * self.cols + x)
+        self.headX, self.headY = self.startLength - 1, y
+        self.foods = set()
+        self.spawnFood()
+    
+    def _push(self, cell):
+        self.body[(self.bodyStart + self.length) % len(self.body)] = cell
+        self.occupied[cell] = 1
+        self.free.remove(cell)
+        self.length += 1
+    
+    def getBody(self):
+        # Cell indices, tail first
+        size = len(self.body)
+        return [self.body[(self.bodyStart + i) % size] for i in range(self.length)]
+    
+    def spawnFood(self):
+        # Tops the food up to `foodCount`, as far as there are free cells
+        while len(self.foods) < self.foodCount and self.free:
+            cell = self.free.sample(self.random)
+            self.free.remove(cell)
+            self.foods.add(cell)
+    
+    def step(self):
+        # Returns False once the snake is dead
+        dx, dy = self.moveDir
+        x, y = self.headX + dx, self.headY + dy
+        if self.wrap:
+            x %= self.cols
+            y %= self.rows
+        elif not (0 <= x < self.cols and 0 <= y < self.rows):
+            self.deathCause = "wall"
+            return False
+        cell = y * self.cols + x
+        ate = cell in self.foods
+        # Moving into the cell the tail end is leaving is fine, unless it grows
+        if self.occupied[cell] and (ate or cell != self.body[self.bodyStart]):
+            self.deathCause = "tail"
+            return False
+        # Inlined rather than _push / _pop, which would cost a free-set update each
+        body = self.body
+        start = self.bodyStart
+        if ate:
+            # Food cells are already out of the free set
+            self.foods.remove(cell)
+            self.length += 1
+        else:
+            tail = body[start]
+            self.occupied[tail] = 0
+            start = self.bodyStart = (start + 1) % len(body)
+            if tail != cell:
+                # The tail end's cell turns free as the head's is taken: trade their slots
+                free = self.free
+                cells, index = free.cells, free.index
+                slot, tailSlot = index[cell], index[tail]
+                cells[slot], cells[tailSlot] = tail, cell
+                index[tail], index[cell] = slot, tailSlot
+        body[(start + self.length - 1) % len(body)] = cell
+        self.occupied[cell] = 1
+        self.headX, self.headY = x, y
+        self.lastDir = self.moveDir
+        self.steps += 1
+        if ate:
+            self.score += 1
+            self.spawnFood()
+        return True
+    
+    def on_keydown(self, key, mod, unicode, scancode):
+        newMoveDir = self.moveDir
+        if key in [pygame.K_w, pygame.K_UP]:
+            newMoveDir = (0, -1)
+        elif key in [pygame.K_s, pygame.K_DOWN]:
+            newMoveDir = (0, 1)
+        elif key in [pygame.K_a, pygame.K_LEFT]:
+            newMoveDir = (-1, 0)
+        elif key in [pygame.K_d, pygame.K_RIGHT]:
+            newMoveDir = (1, 0)
+        # Against the last step taken, so two quick turns can't reverse into the neck
+        if newMoveDir[0] * self.lastDir[0] + newMoveDir[1] * self.lastDir[1] != 0:
+            return
+        self.moveDir = newMoveDir
+    
+    def on_tick(self, scene):
+        self.timer += scene.dt
+        while self.timer >= self.stepTime:
+            self.timer -= self.stepTime
+            if not self.step():
+                if not scene.headless:
+                    print("Dead!")
+                scene.stop()
+                return
+
+
+class GridSnakeTexture(Texture):
+    def __init__(self, gameObject, zIndex=0, colors=((0, 255, 0), (255, 255, 255), (255, 0, 0))):
+        super().__init__(gameObject, zIndex=zIndex)
+        self.bodyColor, self.headColor, self.foodColor = colors
+    
+    def cellRect(self, controller, cell):
+        size = controller.cellSize
+        y, x = divmod(cell, controller.cols)
+        return pygame.Rect(x * size, y * size, size, size)
+    
+    def on_draw(self, drawBuf):
+        controller = self.gameObject.getComponent(GridSnakeController)
+        body = controller.getBody()
+        for cell in body[:-1]:
+            self.draw(drawBuf, self.bodyColor, self.cellRect(controller, cell))
+        if body:
+            self.draw(drawBuf, self.headColor, self.cellRect(controller, body[-1]))
+        for cell in controller.foods:
+            self.draw(drawBuf, self.foodColor, self.cellRect(controller, cell))
@@ -1,16 +1,31 @@
 import pygame
 from engine import *
-import random
-from collections import deque
+import argparse
+import math
+import bisect
+import struct
+import time
+from array import array
 
 
 class SnakeController(Behaviour):
+    # moveDir, speed, length, head pos, food pos, tickCount, flags, RNG gauss_next
+    STATE = struct.Struct("<2dd q 2d 2d q B d")
+    DEATH_CAUSES = (None, "tail")
+    
+    def __init__(self, gameObject, maxStep=16):
+        super().__init__(gameObject)
+        # Longest move per sub-step in px (None: one move per tick); at most the
+        # tail width keeps the tail test exact, food is swept regardless
+        self.maxStep = maxStep
+    
     def on_start(self):
         self.speed = 0.15
+        self.deathCause = None
         self.moveDir = Vector2(1, 0)
         self.head = Head("snakeHead", 1)
         self.head.instantiate(self.gameObject, pos=Vector2(0, 0))
-        self.tail = Tail("snakeTail", 0.5)
+        self.tail = Tail("snakeTail", 0.5, bounds=self.gameObject.getRoot().screen.get_size())
         self.tail.instantiate(self.gameObject, pos=Vector2(0, 0))
         self.length = 22
         self.food = Food("food", -1)
@@ -21,10 +36,58 @@ class SnakeController(Behaviour):
         self.length += 1
         scene = self.gameObject.getRoot()
         foodSize = self.food.getComponent(BoxTexture).size
-        _x = foodSize[0] / 2 + random.random() * (scene.screen.get_rect().width - foodSize[0])
-        _y = foodSize[0] / 2 + random.random() * (scene.screen.get_rect().height - foodSize[1])
+        grid = self.tail.segGrid
+        free = grid.free
+        # Food goes into a grid cell that no tail segment or the head touches, if any is left
+        headCells = [idx for idx in map(grid.cellIndex, grid.cells(self.head.getComponent(BoxCollider).getRect()))
+                     if idx >= 0 and idx in free]
+        for idx in headCells:
+            free.remove(idx)
+        if not free:
+            left, top = 0, 0
+            width, height = scene.screen.get_size()
+        else:
+            cy, cx = divmod(free.sample(scene.random), grid.cols)
+            left, top = cx * grid.cellSize, cy * grid.cellSize
+            width = min(grid.cellSize, scene.screen.get_width() - left)
+            height = min(grid.cellSize, scene.screen.get_height() - top)
+        for idx in headCells:
+            free.add(idx)
+        _x = left + foodSize[0] / 2 + scene.random.random() * (width - foodSize[0])
+        _y = top + foodSize[1] / 2 + scene.random.random() * (height - foodSize[1])
         self.food.transform.pos = Vector2(_x, _y)
     
+    def snapshot(self):
+        # All simulation state as one bytes object: the fixed fields, the scene
+        # RNG's Mersenne Twister state, then the tail
+        scene = self.gameObject.getRoot()
+        version, mt, gauss = scene.random.getstate()
+        head = self.head.transform.pos
+        food = self.food.transform.pos
+        flags = (scene.running << 7) | (gauss is not None) << 6 | self.DEATH_CAUSES.index(self.deathCause)
+        return b"".join((
+            self.STATE.pack(self.moveDir.x, self.moveDir.y, self.speed, self.length, head.x, head.y,
+                            food.x, food.y, scene.tickCount, flags, gauss or 0.0),
+            array("I", mt).tobytes(),
+            self.tail.snapshot(),
+        ))
+    
+    def restore(self, data):
+        # Puts the game back in the state `snapshot` saw, reusing the existing objects
+        scene = self.gameObject.getRoot()
+        state = self.STATE.unpack_from(data)
+        moveX, moveY, self.speed, self.length, headX, headY, foodX, foodY, scene.tickCount, flags, gauss = state
+        self.moveDir = Vector2(moveX, moveY)
+        self.head.transform.pos = Vector2(headX, headY)
+        self.food.transform.pos = Vector2(foodX, foodY)
+        self.deathCause = self.DEATH_CAUSES[flags & 0x3f]
+        scene.running = bool(flags & 0x80)
+        offset = self.STATE.size
+        mt = array("I")
+        mt.frombytes(data[offset:offset + 625 * mt.itemsize])
+        scene.random.setstate((3, tuple(mt), gauss if flags & 0x40 else None))
+        self.tail.restore(data, offset + 625 * mt.itemsize)
+    
     def on_keydown(self, key, mod, unicode, scancode):
         newMoveDir = self.moveDir
         if key in [pygame.K_w, pygame.K_UP]:
@@ -40,19 +103,41 @@ class SnakeController(Behaviour):
         self.moveDir = newMoveDir
     
     def on_tick(self, scene):
+        # A long tick is split into moves of at most `maxStep` px, so the head
+        # can't skip over a tail segment, whatever the tick rate
+        if not scene.dt:
+            return  # Nothing moves, and a zero-length trail segment has no direction
+        steps = 1
+        if self.maxStep:
+            steps = max(1, math.ceil(self.speed * scene.dt / self.maxStep))
+        for _ in range(steps):
+            if not self.move(scene, scene.dt / steps):
+                break
+    
+    def move(self, scene, dt):
         tr = self.head.transform
-        tr.pos += self.moveDir * self.speed * scene.clock.get_time()
+        headCollider = self.head.getComponent(BoxCollider)
+        prevRect = headCollider.getRect()
+        tr.pos += self.moveDir * self.speed * dt
         tr.pos = tr.parent.fromAbsolute(tr.getAbsolutePosition().clamp(scene.screen.get_rect()))
         self.tail.addTrail(tr.pos, self.moveDir)
         # TODO: Collider Component
-        headCollider = self.head.getComponent(BoxCollider)
+        headRect = headCollider.getRect()
+        delta = (headRect.x - prevRect.x, headRect.y - prevRect.y)
+        if abs(delta[0]) + abs(delta[1]) > self.speed * dt + 1:
+            delta = (0, 0)  # Wrapped around the screen edge
         foodCollider = self.food.getComponent(BoxCollider)
-        if Collider.collide(headCollider, foodCollider):
+        # Swept, so food the head passed over mid-move still counts
+        if Collider.sweep(headCollider, foodCollider, delta) is not None:
             self.eat()
         tailCollider = self.tail.getComponent(TailCollider)
         if Collider.collide(headCollider, tailCollider):
-            print("Dead!")
-            self.gameObject.getRoot().stop()
+            self.deathCause = "tail"
+            if not scene.headless:
+                print("Dead!")
+            scene.stop()
+            return False
+        return True
 
 
 class Head(GameObject):
@@ -70,24 +155,51 @@ class Food(GameObject):
 
 
 class TailCollider(Collider):
-    def __init__(self, gameObject, width):
-        super().__init__(gameObject)
+    def __init__(self, gameObject, width, layer=1, mask=Collider.ALL_LAYERS):
+        super().__init__(gameObject, layer=layer, mask=mask)
         self.width = width
     
+    def getBounds(self):
+        trail = self.gameObject.getTrail(self.width)
+        if not trail:
+            return None
+        return trail[0].unionall(trail[1:])
+    
+    def _neckSkip(self):
+        # The neck: rects next to the head that the head always touches
+        tail = self.gameObject
+        skip = 0
+        if not tail.firstGaps[0]:
+            skip += 1
+        if (tail.trimmed or len(tail.trail) >= 2) and not tail.firstGaps[1]:
+            skip += 1
+        return skip
+    
     def _collide(self, other):
         if isinstance(other, BoxCollider):
             otherRect = other.getRect()
-            trail = self.gameObject.getTrail(self.width)
-            #print(trail)
-            if not self.gameObject.trail[0][1]:
-                trail = trail[1:]
-            if len(self.gameObject.trail) >= 2 and not self.gameObject.trail[1][1]:
-                trail = trail[1:]
-            for rect in trail:
+            tail = self.gameObject
+            skip = self._neckSkip()
+            if self.width == tail.width:
+                return tail.collideRect(otherRect, skip)
+            for rect in tail.getTrail(self.width)[skip:]:
                 if otherRect.colliderect(rect):
                     return True
             return False
         return NotImplemented
+    
+    def _sweep(self, other, delta):
+        if isinstance(other, BoxCollider):
+            # The tail moving by `delta` is the box moving the other way
+            otherDelta = (-delta[0], -delta[1])
+            start = other.getRect().move(delta)
+            tail = self.gameObject
+            skip = self._neckSkip()
+            if self.width == tail.width:
+                return tail.sweepRect(start, otherDelta, skip)
+            hits = [sweepRect(start, otherDelta, rect) for rect in tail.getTrail(self.width)[skip:]]
+            return min((t for t in hits if t is not None), default=None)
+        return NotImplemented
 
 
 class TailTexture(Texture):
@@ -101,28 +213,303 @@ class TailTexture(Texture):
             self.draw(drawBuf, self.color, rect)
 
 
+class TrailBuffer:
+    """
+    Ring buffer of trail points, oldest first: parallel x, y and cumulative
+    length arrays plus a gap bitmask. Grows by doubling when full.
+    """
+    
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.xs = array("d", bytes(8 * capacity))
+        self.ys = array("d", bytes(8 * capacity))
+        self.dists = array("d", bytes(8 * capacity))
+        self.gaps = bytearray((capacity + 7) // 8)
+        self.start = 0
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def _index(self, i):
+        if i < 0:
+            i += self.count
+        assert 0 <= i < self.count
+        return (self.start + i) % self.capacity
+    
+    def point(self, i):
+        idx = self._index(i)
+        return Vector2._make(self.xs[idx], self.ys[idx])
+    
+    def gap(self, i):
+        idx = self._index(i)
+        return bool(self.gaps[idx >> 3] & (1 << (idx & 7)))
+    
+    def dist(self, i):
+        return self.dists[self._index(i)]
+    
+    def __getitem__(self, i):
+        return self.point(i), self.gap(i)
+    
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+    
+    def _grow(self):
+        order = [self._index(i) for i in range(self.count)]
+        gaps = [self.gap(i) for i in range(self.count)]
+        pad = bytes(8 * self.capacity)
+        self.xs = array("d", [self.xs[idx] for idx in order]) + array("d", pad)
+        self.ys = array("d", [self.ys[idx] for idx in order]) + array("d", pad)
+        self.dists = array("d", [self.dists[idx] for idx in order]) + array("d", pad)
+        self.capacity *= 2
+        self.gaps = bytearray((self.capacity + 7) // 8)
+        for i, gap in enumerate(gaps):
+            if gap:
+                self.gaps[i >> 3] |= 1 << (i & 7)
+        self.start = 0
+    
+    def append(self, x, y, dist, gap):
+        if self.count == self.capacity:
+            self._grow()
+        idx = (self.start + self.count) % self.capacity
+        self.xs[idx] = x
+        self.ys[idx] = y
+        self.dists[idx] = dist
+        if gap:
+            self.gaps[idx >> 3] |= 1 << (idx & 7)
+        else:
+            self.gaps[idx >> 3] &= ~(1 << (idx & 7))
+        self.count += 1
+    
+    def pop(self):
+        gap = self.gap(-1)
+        self.count -= 1
+        return gap
+    
+    def popleft(self):
+        gap = self.gap(0)
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        return gap
+    
+    def clear(self):
+        self.start = 0
+        self.count = 0
+    
+    def toBytes(self):
+        # Oldest first: count, then the x, y and dist columns and a gap byte per point
+        order = [self._index(i) for i in range(self.count)] if self.start else range(self.count)
+        xs = array("d", [self.xs[idx] for idx in order]) if self.start else self.xs[:self.count]
+        ys = array("d", [self.ys[idx] for idx in order]) if self.start else self.ys[:self.count]
+        dists = array("d", [self.dists[idx] for idx in order]) if self.start else self.dists[:self.count]
+        gaps = bytes(self.gap(i) for i in range(self.count))
+        return b"".join((struct.pack("<I", self.count), xs.tobytes(), ys.tobytes(), dists.tobytes(), gaps))
+    
+    def loadBytes(self, data, offset=0):
+        count, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        columns = []
+        for _ in range(3):
+            column = array("d")
+            column.frombytes(data[offset:offset + 8 * count])
+            columns.append(column)
+            offset += 8 * count
+        gaps = data[offset:offset + count]
+        while self.capacity < count:
+            self.capacity *= 2
+        pad = array("d", bytes(8 * (self.capacity - count)))
+        self.xs, self.ys, self.dists = (column + pad for column in columns)
+        self.gaps = bytearray((self.capacity + 7) // 8)
+        for i, gap in enumerate(gaps):
+            if gap:
+                self.gaps[i >> 3] |= 1 << (i & 7)
+        self.start = 0
+        self.count = count
+        return offset + count
+
+
 class Tail(GameObject):
-    def __init__(self, name=None, zIndex=0):
+    def __init__(self, name=None, zIndex=0, width=32, trimSlack=2, cellSize=64, bounds=(800, 600)):
         super().__init__(name)
-        self.trail = deque()
-        self.addComponent(TailTexture, 32, (0, 255, 0), zIndex=zIndex)
-        self.addComponent(TailCollider, 32)
+        self.trail = TrailBuffer()
+        self.width = width
+        # Points are dropped once they lie `length + trimSlack` units behind the head;
+        # the slack lets a fresh eat still uncover trail behind the tail end
+        self.trimSlack = trimSlack
+        # TailCollider's neck rule reads the gap flags of the first two recorded
+        # points, which trimming would otherwise throw away
+        self.firstGaps = [False, False]
+        self.trimmed = False
+        # Geometry of the non-gap segments at `width`, oldest first, kept in step with
+        # `trail` by addTrail: the full rect, the summed length of all older segments,
+        # and (newer point, older point, dir, radius) for cutting the last one short
+        self.segRects = []
+        self.segStarts = []
+        self.segGeometry = []
+        self.segTotal = 0
+        # Full segment rects hashed by cell under their id, segFirstId + list index;
+        # its free cells within `bounds` are where food can go
+        self.segGrid = SpatialGrid(cellSize, bounds)
+        self.segFirstId = 0
+        self.version = 0
+        self._cutCache = None
+        self._trailCache = None
+        self.addComponent(TailTexture, width, (0, 255, 0), zIndex=zIndex)
+        self.addComponent(TailCollider, width)
     
     def addTrail(self, pos, moveDir):
+        trail = self.trail
         gap = False
-        if len(self.trail) >= 2:
-            lastDir = self.trail[-1][0] - self.trail[-2][0]
-            curDir = pos - self.trail[-1][0]
+        replaced = None
+        if len(trail) >= 2:
+            last = trail.point(-1)
+            lastDir = last - trail.point(-2)
+            curDir = pos - last
             if curDir * moveDir < 0:
                 gap = True
             elif curDir * lastDir > 0:
-                self.trail.pop()
-        self.trail.append((pos, gap))
-        # !Clear
-        if len(self.trail) >= 10 ** 4:
-            self.trail.popleft()
+                if not trail.pop():
+                    replaced = self._popSegment(keepInGrid=True)
+        if len(trail) and not gap:
+            self._pushSegment(pos, trail.point(-1), replaced)
+        trail.append(pos.x, pos.y, self.segTotal, gap)
+        if not self.trimmed and len(trail) <= 2:
+            self.firstGaps[len(trail) - 1] = gap
+        self._trim()
+        self.version += 1
+    
+    def snapshot(self):
+        flags = self.firstGaps[0] | self.firstGaps[1] << 1 | self.trimmed << 2
+        return bytes((flags,)) + self.trail.toBytes() + self.segGrid.free.toBytes()
+    
+    def restore(self, data, offset=0):
+        flags = data[offset]
+        self.firstGaps = [bool(flags & 1), bool(flags & 2)]
+        self.trimmed = bool(flags & 4)
+        trail = self.trail
+        offset = trail.loadBytes(data, offset + 1)
+        # The segment geometry is derived from the points, so it is rebuilt rather than stored
+        self.segRects = []
+        self.segStarts = []
+        self.segGeometry = []
+        self.segGrid.clear()
+        self.segFirstId = 0
+        for i in range(1, len(trail)):
+            if not trail.gap(i):
+                self.segTotal = trail.dist(i - 1)
+                self._pushSegment(trail.point(i), trail.point(i - 1))
+        self.segTotal = trail.dist(-1) if len(trail) else 0
+        self.segGrid.free.loadBytes(data, offset)
+        self.version += 1
+        self._cutCache = None
+        self._trailCache = None
+    
+    def _trim(self):
+        trail = self.trail
+        limit = (self.getParent().getComponent(SnakeController).length + self.trimSlack) * 32
+        # The oldest point can go once the one after it is already past the limit
+        while len(trail) > 2 and self.segTotal - trail.dist(1) >= limit:
+            trail.popleft()
+            self.trimmed = True
+            if not trail.gap(0):
+                self.segGrid.remove(self.segFirstId, self.segRects[0])
+                self.segFirstId += 1
+                del self.segRects[0], self.segStarts[0], self.segGeometry[0]
+    
+    def _pushSegment(self, prevPoint, curPoint, replacing=None):
+        segLen = abs(curPoint - prevPoint)
+        dir = (curPoint - prevPoint).normalize()
+        radius = dir.rotate90() * (self.width / 2)
+        r0 = prevPoint - radius - dir * 16
+        r1 = curPoint + radius + dir * 16
+        rect = Vector2.rect(r0, r1)
+        segId = self.segFirstId + len(self.segRects)
+        if replacing is None:
+            self.segGrid.insert(segId, rect)
+        else:
+            # The head segment re-pushed under the same id after a collinear merge
+            self.segGrid.move(segId, replacing, rect)
+        self.segRects.append(rect)
+        self.segStarts.append(self.segTotal)
+        self.segGeometry.append((prevPoint, curPoint, dir, radius))
+        self.segTotal += segLen
+    
+    def _popSegment(self, keepInGrid=False):
+        rect = self.segRects.pop()
+        if not keepInGrid:
+            self.segGrid.remove(self.segFirstId + len(self.segRects), rect)
+        self.segTotal = self.segStarts.pop()
+        self.segGeometry.pop()
+        return rect
+    
+    def _getCut(self):
+        # The newest segment whose older end lies `limit` or further from the head
+        # is cut short; returns its index (-1 if none) and shortened rect
+        limit = self.getParent().getComponent(SnakeController).length * 32
+        key = (self.version, limit)
+        if self._cutCache is not None and self._cutCache[0] == key:
+            return self._cutCache[1]
+        cut = bisect.bisect_right(self.segStarts, self.segTotal - limit) - 1
+        rect = None
+        if cut >= 0:
+            prevPoint, curPoint, dir, radius = self.segGeometry[cut]
+            rem = limit - (self.segTotal - self.segStarts[cut])
+            r0 = prevPoint - radius - dir * 16
+            r1 = curPoint + dir * rem + radius + dir * 16
+            rect = Vector2.rect(r0, r1)
+        self._cutCache = (key, (cut, rect))
+        return cut, rect
     
     def getTrail(self, width):
+        if width != self.width:
+            return self._buildTrail(width)
+        cut, cutRect = self._getCut()
+        if self._trailCache is not None and self._trailCache[0] == self._cutCache[0]:
+            return self._trailCache[1]
+        res = self.segRects[cut + 1:]
+        res.reverse()
+        if cut >= 0:
+            res.append(cutRect)
+        # Shared until the next addTrail or length change; callers must not modify it
+        self._trailCache = (self._cutCache[0], res)
+        return res
+    
+    def collideRect(self, rect, skip=0):
+        # Same result as testing getTrail(self.width)[skip:], but only looks at
+        # segments hashed into the cells `rect` overlaps
+        cut, cutRect = self._getCut()
+        oldest = max(cut, 0)
+        newest = len(self.segRects) - 1 - skip
+        if newest < oldest:
+            return False
+        for segId in self.segGrid.query(rect):
+            idx = segId - self.segFirstId
+            if idx < oldest or idx > newest:
+                continue
+            if rect.colliderect(cutRect if idx == cut else self.segRects[idx]):
+                return True
+        return False
+    
+    def sweepRect(self, rect, delta, skip=0):
+        # Like collideRect for `rect` moving by `delta`: the earliest fraction of the
+        # move at which it touches a segment, or None
+        cut, cutRect = self._getCut()
+        oldest = max(cut, 0)
+        newest = len(self.segRects) - 1 - skip
+        if newest < oldest:
+            return None
+        res = None
+        for segId in self.segGrid.query(rect.union(rect.move(delta))):
+            idx = segId - self.segFirstId
+            if idx < oldest or idx > newest:
+                continue
+            t = sweepRect(rect, delta, cutRect if idx == cut else self.segRects[idx])
+            if t is not None and (res is None or t < res):
+                res = t
+        return res
+    
+    def _buildTrail(self, width):
         trail = list(self.trail)[::-1]
         res = []
         rem = self.getParent().getComponent(SnakeController).length * 32
@@ -148,17 +535,69 @@ class Tail(GameObject):
         return res
 
 
+def spawnSnake(scene, discrete=False):
+    snake = GameObject()
+    if discrete:
+        import grid
+        snake.addComponent(grid.GridSnakeController)
+    else:
+        snake.addComponent(SnakeController)
+    snake.instantiate(scene)
+    return snake
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Snake")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--dt", type=float, default=None, help="fixed simulation step in ms (default: frame time)")
+    parser.add_argument("--record", metavar="PATH", help="save a replay of this game")
+    parser.add_argument("--replay", metavar="PATH", help="play a replay back headless and print the outcome")
+    parser.add_argument("--fps", type=float, default=60, help="frame rate limit (default: 60)")
+    parser.add_argument("--vsync", action="store_true", help="sync frames to the display")
+    parser.add_argument("--grid", action="store_true", help="play the discrete, cell-by-cell game")
+    parser.add_argument("--profile", metavar="PATH", help="show a profiler overlay and export the stats (.json/.csv)")
+    args = parser.parse_args()
+    
     pygame.init()
     size = 800, 600
     
-    scene = Scene(size=size, bgColor=(0, 0, 0))
-    snake = GameObject()
-    snake.addComponent(SnakeController)
-    snake.instantiate(scene)
-    scene.run()
+    if args.replay:
+        replay = Replay.load(args.replay)
+        scene = Scene(size=size, headless=True, fixedDt=replay.fixedDt, seed=replay.seed)
+        # Replay mode 1 is the grid game
+        snake = spawnSnake(scene, replay.mode == 1)
+        if replay.mode == 1:
+            import grid
+            controller = snake.getComponent(grid.GridSnakeController)
+        else:
+            controller = snake.getComponent(SnakeController)
+        startTime = time.perf_counter()
+        ticks = scene.playback(replay)
+        print("{} ticks in {:.3f}s: length {}, {}".format(ticks, time.perf_counter() - startTime,
+                                                          controller.length, controller.deathCause or "quit"))
+        return
+    
+    record = args.record is not None
+    scene = Scene(size=size, bgColor=(0, 0, 0), seed=args.seed, fpsLimit=args.fps, vsync=args.vsync,
+                  fixedDt=args.dt if args.dt is not None or not record else 16, record=record)
+    spawnSnake(scene, args.grid)
+    if record:
+        scene.replay.mode = int(args.grid)
+    profiler = None
+    if args.profile:
+        profiler = Profiler().enable()
+        scene.addComponent(ProfilerOverlay)
+    try:
+        scene.run()
+    finally:
+        if record:
+            scene.replay.save(args.record)
+        if profiler is not None:
+            profiler.disable()
+            profiler.export(args.profile)
 
-try:
-    main()
-finally:
-    pygame.quit()
\ No newline at end of file
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        pygame.quit()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from collections import namedtuple
+
+import pygame
+from engine import *
+from main import SnakeController
+
+
+EpisodeResult = namedtuple("EpisodeResult", "seed score length steps cause wallTime")
+
+MOVE_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+
+
+def idlePolicy(controller, rng):
+    return None
+
+
+def randomTurnPolicy(controller, rng, turnChance=0.02):
+    if rng.random() < turnChance:
+        return rng.choice(MOVE_KEYS)
+    return None
+
+
+class ScriptedPolicy:
+    def __init__(self, script):
+        # {tick: key}; picklable, so it can be shipped to worker processes
+        self.script = dict(script)
+        self.tick = 0
+    
+    def __call__(self, controller, rng):
+        key = self.script.get(self.tick)
+        self.tick += 1
+        return key
+
+
+def runEpisode(seed, policy=idlePolicy, maxSteps=10000, size=(800, 600), fixedDt=16):
+    rng = random.Random(seed ^ 0x5EED)
+    if isinstance(policy, ScriptedPolicy):
+        policy = ScriptedPolicy(policy.script)
+    
+    startTime = time.perf_counter()
+    scene = Scene(size=size, headless=True, fixedDt=fixedDt, seed=seed)
+    snake = GameObject("snake")
+    snake.addComponent(SnakeController)
+    snake.instantiate(scene)
+    scene.start()
+    controller = snake.getComponent(SnakeController)
+    startLength = controller.length
+    
+    steps = 0
+    while scene.running and steps < maxSteps:
+        key = policy(controller, rng)
+        if key is not None:
+            scene.handleEvent(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0))
+        scene.step()
+        steps += 1
+    
+    cause = controller.deathCause or "timeout"
+    return EpisodeResult(seed, controller.length - startLength, controller.length, steps, cause,
+                         time.perf_counter() - startTime)
+
+
+_workerArgs = None
+
+
+def _initWorker(args):
+    global _workerArgs
+    _workerArgs = args
+
+
+def _runChunk(seeds):
+    policy, maxSteps, size, fixedDt = _workerArgs
+    return [runEpisode(seed, policy, maxSteps, size, fixedDt) for seed in seeds]
+
+
+def runEpisodes(seeds, policy=idlePolicy, maxSteps=10000, size=(800, 600), fixedDt=16,
+                workers=None, chunkSize=None):
+    seeds = list(seeds)
+    workers = workers or os.cpu_count() or 1
+    if chunkSize is None:
+        chunkSize = max(1, len(seeds) // (workers * 4))
+    # Chunks are dispatched as single tasks: one pickle round-trip per chunk, not per episode
+    chunks = [seeds[i:i + chunkSize] for i in range(0, len(seeds), chunkSize)]
+    args = (policy, maxSteps, size, fixedDt)
+    if workers == 1:
+        _initWorker(args)
+        return [res for chunk in chunks for res in _runChunk(chunk)]
+    with multiprocessing.Pool(workers, initializer=_initWorker, initargs=(args,)) as pool:
+        return [res for chunkRes in pool.imap(_runChunk, chunks) for res in chunkRes]
+
+
+POLICIES = {
+    "idle": idlePolicy,
+    "random": randomTurnPolicy,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless snake episodes on every core")
+    parser.add_argument("-n", "--episodes", type=int, default=100)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-p", "--policy", choices=POLICIES, default="random")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-c", "--chunk-size", type=int, default=None)
+    parser.add_argument("--max-steps", type=int, default=10000)
+    parser.add_argument("--dt", type=float, default=16)
+    args = parser.parse_args()
+    
+    startTime = time.perf_counter()
+    results = runEpisodes(range(args.seed, args.seed + args.episodes), POLICIES[args.policy],
+                          maxSteps=args.max_steps, fixedDt=args.dt,
+                          workers=args.workers, chunkSize=args.chunk_size)
+    wallTime = time.perf_counter() - startTime
+    
+    print("seed,score,length,steps,cause,wallTime")
+    for res in results:
+        print("{},{},{},{},{},{:.4f}".format(*res))
+    totalSteps = sum(res.steps for res in results)
+    print("# {} episodes, {} steps in {:.2f}s ({:.0f} steps/s)".format(
+        len(results), totalSteps, wallTime, totalSteps / wallTime))
+
+
+if __name__ == "__main__":
+    main()
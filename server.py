@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import random
+import struct
+import time
+from collections import deque
+
+import pygame
+from engine import *
+from main import SnakeController, spawnSnake
+
+
+# Every message is a little-endian u32 length followed by the payload, whose first byte is its type.
+# Client -> server: INPUT (event type, key). Server -> client: HELLO (session id, seed, fixedDt, width,
+# height), STATE (tick, flags, head, then food / length / trail delta as flagged) and END (cause, length).
+FRAME = struct.Struct("<I")
+HELLO, STATE, END, INPUT = range(4)
+HELLO_MSG = struct.Struct("<BIQdHH")
+STATE_HEADER = struct.Struct("<BIBff")
+FOOD = struct.Struct("<ff")
+LENGTH = struct.Struct("<H")
+TRAIL_HEADER = struct.Struct("<HHH")
+TRAIL_POINT = struct.Struct("<ffB")
+END_MSG = struct.Struct("<BBH")
+INPUT_MSG = struct.Struct("<BBI")
+# Longest frame a client may send; anything else is a protocol error
+MAX_INPUT_FRAME = 64
+
+# STATE flags
+FOOD_CHANGED, LENGTH_CHANGED, TRAIL_CHANGED, TRAIL_RESET = (1 << i for i in range(4))
+
+# INPUT event types, and END causes
+INPUT_TYPES = (pygame.KEYDOWN, pygame.KEYUP, pygame.QUIT)
+CAUSES = ("quit", "tail", "disconnect", "protocol")
+
+
+class Session:
+    """
+    One game: a headless Scene ticked by the server, fed by one client's input,
+    streaming back what changed since the last state the client received.
+    """
+
+    def __init__(self, sessionId, reader, writer, seed, fixedDt, size, maxBuffer=1 << 16):
+        self.sessionId = sessionId
+        self.reader = reader
+        self.writer = writer
+        self.maxBuffer = maxBuffer
+        self.scene = Scene(size=size, headless=True, fixedDt=fixedDt, seed=seed)
+        self.controller = spawnSnake(self.scene).getComponent(SnakeController)
+        self.inputs = deque()
+        self.cause = None
+        # The client's view, as of the last STATE sent
+        self.sentTrail = deque()
+        self.sentFood = None
+        self.sentLength = None
+        # Thread CPU time spent ticking and encoding, and traffic in both directions
+        self.cpuTime = 0.0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.skipped = 0
+        self.scene.start()
+        self.send(HELLO_MSG.pack(HELLO, sessionId, seed, fixedDt, *size))
+
+    @property
+    def ended(self):
+        return self.cause is not None
+
+    def send(self, payload):
+        self.writer.write(FRAME.pack(len(payload)) + payload)
+        self.bytesSent += FRAME.size + len(payload)
+
+    async def readInputs(self):
+        try:
+            while not self.ended:
+                size, = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+                if not 0 < size <= MAX_INPUT_FRAME:
+                    self.end("protocol")
+                    return
+                payload = await self.reader.readexactly(size)
+                self.bytesReceived += FRAME.size + size
+                if payload[0] == INPUT and size == INPUT_MSG.size:
+                    _, type, key = INPUT_MSG.unpack(payload)
+                    if type < len(INPUT_TYPES):
+                        self.inputs.append((INPUT_TYPES[type], key))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if not self.ended:
+                self.end("disconnect")
+
+    def advance(self):
+        startTime = time.thread_time()
+        scene = self.scene
+        while self.inputs:
+            type, key = self.inputs.popleft()
+            if type == pygame.QUIT:
+                scene.handleEvent(pygame.event.Event(type))
+            else:
+                scene.handleEvent(pygame.event.Event(type, key=key, mod=0, unicode="", scancode=0))
+        if scene.running:
+            scene.step()
+        # A client that can't keep up gets fewer, larger deltas instead of a growing buffer
+        if self.writer.transport.get_write_buffer_size() <= self.maxBuffer:
+            self.send(self.encodeState())
+        else:
+            self.skipped += 1
+        self.cpuTime += time.thread_time() - startTime
+        if not scene.running:
+            self.end(self.controller.deathCause or "quit")
+
+    def encodeState(self):
+        controller = self.controller
+        head = controller.head.transform.getAbsolutePosition()
+        food = controller.food.transform.pos
+        flags = 0
+        parts = []
+        if (food.x, food.y) != self.sentFood:
+            self.sentFood = (food.x, food.y)
+            flags |= FOOD_CHANGED
+            parts.append(FOOD.pack(food.x, food.y))
+        if controller.length != self.sentLength:
+            self.sentLength = controller.length
+            flags |= LENGTH_CHANGED
+            parts.append(LENGTH.pack(controller.length))
+        trailDelta = self.encodeTrail()
+        if trailDelta is not None:
+            reset, delta = trailDelta
+            flags |= TRAIL_CHANGED | (TRAIL_RESET if reset else 0)
+            parts.append(delta)
+        header = STATE_HEADER.pack(STATE, self.scene.tickCount, flags, head.x, head.y)
+        return header + b"".join(parts)
+
+    def encodeTrail(self):
+        # The trail only loses points at the front (trimming) and at the back (collinear
+        # merges) and gains them at the back, so it is sent as (dropped from the front,
+        # dropped from the back, appended points); None if nothing changed
+        trail = self.controller.tail.trail
+        sent = self.sentTrail
+        count = len(trail)
+        front = 0
+        if count:
+            first = (trail.xs[trail._index(0)], trail.ys[trail._index(0)], trail.gap(0))
+            while front < len(sent) and sent[front] != first:
+                front += 1
+        reset = not count or front == len(sent)
+        if reset:
+            front, back, kept = len(sent), 0, 0
+        else:
+            # Matching from the end of what the client has, back to where it still agrees
+            kept = len(sent) - front
+            while kept and (kept > count or sent[front + kept - 1] != self._point(trail, kept - 1)):
+                kept -= 1
+            back = len(sent) - front - kept
+        if not (front or back or count - kept):
+            return None
+        for _ in range(front):
+            sent.popleft()
+        for _ in range(back):
+            sent.pop()
+        if reset:
+            sent.clear()
+        points = [self._point(trail, i) for i in range(kept, count)]
+        sent.extend(points)
+        delta = TRAIL_HEADER.pack(0 if reset else front, back, len(points))
+        return reset, delta + b"".join(TRAIL_POINT.pack(*point) for point in points)
+
+    @staticmethod
+    def _point(trail, i):
+        idx = trail._index(i)
+        return trail.xs[idx], trail.ys[idx], trail.gap(i)
+
+    def end(self, cause):
+        self.cause = cause
+        self.scene.running = False
+        if self.writer.is_closing():
+            return
+        # A client that has gone away gets no END, but its socket still has to be closed
+        if cause != "disconnect":
+            self.send(END_MSG.pack(END, CAUSES.index(cause), self.controller.length))
+        self.writer.close()
+
+    def stats(self):
+        ticks = self.scene.tickCount
+        return {
+            "session": self.sessionId,
+            "cause": self.cause,
+            "ticks": ticks,
+            "length": self.controller.length,
+            "cpuMs": self.cpuTime * 1000,
+            "cpuUsPerTick": self.cpuTime * 1e6 / ticks if ticks else 0.0,
+            "bytesSent": self.bytesSent,
+            "bytesPerTick": self.bytesSent / ticks if ticks else 0.0,
+            "bytesReceived": self.bytesReceived,
+            "skippedStates": self.skipped,
+        }
+
+
+class GameServer:
+    """
+    Hosts one Session per TCP connection and ticks all of them from a single
+    asyncio task, every `fixedDt` ms. A finished session only closes its
+    connection; the server keeps running.
+    """
+
+    def __init__(self, fixedDt=16, size=(800, 600), seed=None, verbose=True):
+        self.fixedDt = fixedDt
+        self.size = size
+        self.seeds = random.Random(seed)
+        self.verbose = verbose
+        self.sessions = {}
+        self.finished = []
+        self._nextId = 0
+        self._ticker = None
+
+    async def handleClient(self, reader, writer):
+        sessionId = self._nextId
+        self._nextId += 1
+        session = Session(sessionId, reader, writer, self.seeds.getrandbits(64), self.fixedDt, self.size)
+        self.sessions[sessionId] = session
+        await session.readInputs()
+
+    def tickAll(self):
+        for session in list(self.sessions.values()):
+            if not session.ended:
+                session.advance()
+            if session.ended:
+                del self.sessions[session.sessionId]
+                stats = session.stats()
+                self.finished.append(stats)
+                if self.verbose:
+                    print("session {session} ended ({cause}) after {ticks} ticks: length {length}, "
+                          "{cpuUsPerTick:.1f} us/tick CPU, {bytesPerTick:.1f} B/tick sent".format(**stats))
+
+    async def tickLoop(self):
+        loop = asyncio.get_running_loop()
+        interval = self.fixedDt / 1000
+        deadline = loop.time()
+        while True:
+            self.tickAll()
+            deadline += interval
+            delay = deadline - loop.time()
+            if delay < 0:
+                deadline -= delay  # Overloaded: carry on from now rather than bursting to catch up
+            await asyncio.sleep(max(delay, 0))
+
+    async def serve(self, host="127.0.0.1", port=7777):
+        server = await asyncio.start_server(self.handleClient, host, port)
+        self._ticker = asyncio.create_task(self.tickLoop())
+        return server
+
+
+class GameClient:
+    """
+    Minimal client: connects, sends key events and rebuilds the session's state
+    (head, food, length and trail points) from the stream.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.sessionId = None
+        self.tick = 0
+        self.head = None
+        self.food = None
+        self.length = None
+        self.trail = deque()
+        self.cause = None
+
+    async def connect(self, host="127.0.0.1", port=7777):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        await self.receive()
+
+    def sendKey(self, key, down=True):
+        payload = INPUT_MSG.pack(INPUT, 0 if down else 1, key)
+        self.writer.write(FRAME.pack(len(payload)) + payload)
+
+    async def receive(self):
+        # Applies the next message; returns False once the session has ended
+        size, = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+        payload = await self.reader.readexactly(size)
+        kind = payload[0]
+        if kind == HELLO:
+            _, self.sessionId, self.seed, self.fixedDt, width, height = HELLO_MSG.unpack(payload)
+        elif kind == STATE:
+            self._applyState(payload)
+        elif kind == END:
+            _, cause, self.length = END_MSG.unpack(payload)
+            self.cause = CAUSES[cause]
+            return False
+        return True
+
+    def _applyState(self, payload):
+        _, self.tick, flags, headX, headY = STATE_HEADER.unpack_from(payload)
+        self.head = (headX, headY)
+        offset = STATE_HEADER.size
+        if flags & FOOD_CHANGED:
+            self.food = FOOD.unpack_from(payload, offset)
+            offset += FOOD.size
+        if flags & LENGTH_CHANGED:
+            self.length, = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+        if flags & TRAIL_CHANGED:
+            front, back, count = TRAIL_HEADER.unpack_from(payload, offset)
+            offset += TRAIL_HEADER.size
+            if flags & TRAIL_RESET:
+                self.trail.clear()
+            for _ in range(front):
+                self.trail.popleft()
+            for _ in range(back):
+                self.trail.pop()
+            for _ in range(count):
+                self.trail.append(TRAIL_POINT.unpack_from(payload, offset))
+                offset += TRAIL_POINT.size
+
+    def close(self):
+        self.writer.close()
+
+
+async def runBot(host, port, seed, maxTicks):
+    # A client steering at random, like rollout's random policy
+    rng = random.Random(seed)
+    client = GameClient()
+    await client.connect(host, port)
+    keys = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+    while await client.receive():
+        if client.tick >= maxTicks:
+            client.close()
+            break
+        if rng.random() < 0.02:
+            client.sendKey(rng.choice(keys))
+    return client
+
+
+async def serveForever(args):
+    gameServer = GameServer(fixedDt=args.dt, seed=args.seed)
+    server = await gameServer.serve(args.host, args.port)
+    print("serving on {}:{}".format(args.host, args.port))
+    async with server:
+        if args.bots:
+            await asyncio.gather(*(runBot(args.host, args.port, i, args.max_ticks) for i in range(args.bots)))
+            await asyncio.sleep(2 * args.dt / 1000)
+            finished = gameServer.finished
+            print("# {} sessions, {:.1f} us/tick CPU, {:.1f} B/tick sent on average".format(
+                len(finished),
+                sum(stats["cpuMs"] for stats in finished) * 1000 / max(1, sum(stats["ticks"] for stats in finished)),
+                sum(stats["bytesSent"] for stats in finished) / max(1, sum(stats["ticks"] for stats in finished))))
+            return
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many headless snake games over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--dt", type=float, default=16, help="simulation step in ms")
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("--bots", type=int, default=0, help="run this many local random bots, then exit")
+    parser.add_argument("--max-ticks", type=int, default=2000, help="ticks after which a bot disconnects")
+    args = parser.parse_args()
+    asyncio.run(serveForever(args))
+
+
+if __name__ == "__main__":
+    main()